@@ -3,18 +3,21 @@ from os.path import dirname, abspath
 import yaml
 from omegaconf import DictConfig
 from datetime import datetime
-from copy import deepcopy
 
 import graphium
 from graphium.config._loader import load_datamodule, load_accelerator
 import time
 from typing import Optional, List, Sequence
 import wandb
-import statistics
 import tqdm
 import torch
 import numpy as np
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # Set up the working directory
 MAIN_DIR = dirname(dirname(abspath(graphium.__file__)))
 os.chdir(MAIN_DIR)
@@ -24,35 +27,62 @@ CONFIG_FILE = "expts/neurips2023_configs/config_large_gcn.yaml"
 # CONFIG_FILE = "expts/configs/config_ipu_qm9.yaml"
 
 
-def benchmark(fn, *args, message="", log2wandb=False, **kwargs):
-    start = time.time()
+def load_config_file(path):
+    """
+    Load a YAML config with the libyaml C parser when available, much faster than the python one.
+    """
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def benchmark(fn, *args, message="", durations=None, **kwargs):
+    start = time.perf_counter_ns()
     value = fn(*args, **kwargs)
-    duration = time.time() - start
+    duration = (time.perf_counter_ns() - start) / 1e9
     print(f"{message} {duration:.3f} secs")
-    if log2wandb:
-        wandb.log({message: duration})
+    if durations is not None:
+        durations[message] = duration
     return value
 
 
-def benchmark_dataloader(dataloader, name, n_epochs=5, log2wandb=False):
+def benchmark_dataloader(dataloader, name, n_epochs=5, log2wandb=False, device=None, progress=True):
     print(f"length of {name} dataloader: {len(dataloader)}")
-    epoch_times = [0] * n_epochs
-    tputs = [0] * n_epochs
-    n_batches = [0] * n_epochs
-    n_graphs = [0] * n_epochs
-    n_nodes = [0] * n_epochs
-    n_edges = [0] * n_epochs
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device)
+
+    epoch_times = np.zeros(n_epochs, dtype=np.float64)
+    tputs = np.zeros(n_epochs, dtype=np.float64)
+    n_batches = np.zeros(n_epochs, dtype=np.int64)
+    n_graphs = np.zeros(n_epochs, dtype=np.int64)
+    n_nodes = np.zeros(n_epochs, dtype=np.int64)
+    n_edges = np.zeros(n_epochs, dtype=np.int64)
     for i in range(n_epochs):
-        start = time.time()
-        for data in tqdm.tqdm(dataloader):
-            n_batches[i] += 1
-            n_graphs[i] += torch.sum(torch.max(data["features"]["batch"], dim=-1).values).item()
-            n_nodes[i] += np.prod(data["features"]["batch"].shape)
-            n_edges[i] += np.prod(data["features"]["edge_weight"].shape)
-        epoch_times[i] = time.time() - start
+        start = time.perf_counter()
+        # Accumulate on the device to avoid a host-device sync with `.item()` at every batch
+        running_graphs = torch.zeros((), dtype=torch.int64, device=device)
+        # Plain ints in the loop, stored in the arrays once per epoch
+        running_batches, running_nodes, running_edges = 0, 0, 0
+        # Refresh the progress bar at most once per second, to keep it out of the timed loop
+        pbar = tqdm.tqdm(dataloader, mininterval=1.0, smoothing=0, disable=not progress)
+        for data in pbar:
+            features = data["features"]
+            # The batches are pinned by the dataloader, so the copy can overlap with the iteration
+            batch = features["batch"].to(device, non_blocking=True)
+            running_batches += 1
+            # The batch vector is sorted, so the last element is the index of the last graph
+            running_graphs += batch[-1] + 1
+            # Sizes are read from the shapes, without any kernel launch or sync
+            running_nodes += features["batch"].numel()
+            running_edges += features["edge_index"].size(-1)
+        n_batches[i] = running_batches
+        n_graphs[i] = running_graphs.item()
+        n_nodes[i] = running_nodes
+        n_edges[i] = running_edges
+        epoch_times[i] = time.perf_counter() - start
         tputs[i] = n_graphs[i] / epoch_times[i]
 
-    average_tput = statistics.mean(tputs)
+    average_tput = tputs.mean()
     print(f"{name} dataloader average tput {average_tput}")
     print(f"{name} dataloader tputs per epoch {tputs}")
     print(f"{name} dataloader epoch times {epoch_times}")
@@ -62,8 +92,7 @@ def benchmark_dataloader(dataloader, name, n_epochs=5, log2wandb=False):
     print(f"{name} dataloader total edges per epoch {n_edges}")
 
     if log2wandb:
-        wandb.log({"average tput": average_tput})
-
+        # A single `wandb.log` call per epoch, with the summary logged along the last epoch
         for i in range(n_epochs):
             d = {
                 "epoch": i,
@@ -74,6 +103,8 @@ def benchmark_dataloader(dataloader, name, n_epochs=5, log2wandb=False):
                 "nodes per epoch": n_nodes[i],
                 "edges per epoch": n_edges[i],
             }
+            if i == n_epochs - 1:
+                d["average tput"] = average_tput
             print(d)
             wandb.log(d)
 
@@ -91,27 +122,46 @@ def main(
     if log2wandb:
         wandb.init(project="multitask-gnn", name=run_name, config=cfg)
 
-    cfg = deepcopy(cfg)
+    # `load_accelerator` already returns a copy of the config
     cfg, accelerator_type = load_accelerator(cfg)
-    # Load and initialize the dataset
+
+    # Load the data with parallel workers by default. The datamodule keeps them alive between
+    # the benchmarked epochs, instead of re-spawning them and re-importing the featurizer.
+    cfg["datamodule"]["args"].setdefault("num_workers", min((os.cpu_count() or 0) // 2, 8))
+
+    # Time the loading, preparation and setup, and log them together
+    durations = {}
     datamodule = benchmark(
-        load_datamodule, cfg, accelerator_type, message="Load duration", log2wandb=log2wandb
+        load_datamodule, cfg, accelerator_type, message="Load duration", durations=durations
     )
 
-    benchmark(datamodule.prepare_data, message="Prepare duration", log2wandb=log2wandb)
+    # The datamodule skips the featurization when its processed data is cached under a matching hash,
+    # so `prepare_data` is only expensive on the first run with a given `processed_graph_data_path`
+    prepared_from_cache = getattr(datamodule, "_data_is_cached", False)
+    if getattr(datamodule, "processed_graph_data_path", None) is None:
+        print("No `processed_graph_data_path` given, the data will be featurized at every run")
+    elif prepared_from_cache:
+        print(f"Loading the prepared data from `{datamodule.processed_graph_data_path}`")
+    benchmark(datamodule.prepare_data, message="Prepare duration", durations=durations)
+    durations["Prepared from cache"] = prepared_from_cache
 
     if False:  # stages is not None:
         for stage in stages:
-            benchmark(datamodule.setup, stage, message=f"Setup {stage} duration", log2wandb=log2wandb)
+            benchmark(datamodule.setup, stage, message=f"Setup {stage} duration", durations=durations)
     else:
-        benchmark(datamodule.setup, message=f"Setup duration", log2wandb=log2wandb)
+        benchmark(datamodule.setup, message=f"Setup duration", durations=durations)
+
+    if log2wandb:
+        wandb.log(durations)
+
+    stages_set = None if stages is None else frozenset(stage.lower() for stage in stages)
 
-    if stages is None or {"train", "fit"}.intersection(stages):
+    if stages_set is None or not stages_set.isdisjoint(("train", "fit")):
         dataloader = datamodule.train_dataloader()
         benchmark_dataloader(
             dataloader, name="train", n_epochs=cfg["trainer"]["trainer"]["max_epochs"], log2wandb=log2wandb
         )
-    if stages is None or {"val", "valid", "validation"}.intersection(stages):
+    if stages_set is None or not stages_set.isdisjoint(("val", "valid", "validation")):
         dataloader = datamodule.val_dataloader()
         benchmark_dataloader(
             dataloader,
@@ -119,7 +169,7 @@ def main(
             n_epochs=cfg["trainer"]["trainer"]["max_epochs"],
             log2wandb=log2wandb,
         )
-    if stages is None or {"test", "testing"}.intersection(stages):
+    if stages_set is None or not stages_set.isdisjoint(("test", "testing")):
         dataloader = datamodule.test_dataloader()
         benchmark_dataloader(
             dataloader, name="testing", n_epochs=cfg["trainer"]["trainer"]["max_epochs"], log2wandb=log2wandb
@@ -127,6 +177,5 @@ def main(
 
 
 if __name__ == "__main__":
-    with open(os.path.join(MAIN_DIR, CONFIG_FILE), "r") as f:
-        cfg = yaml.safe_load(f)
+    cfg = load_config_file(os.path.join(MAIN_DIR, CONFIG_FILE))
     main(cfg, stages=["train"], log2wandb=True)
@@ -1,6 +1,7 @@
 # Misc
 import os
 from copy import deepcopy
+from functools import lru_cache
 from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Type, Union
 
 import joblib
@@ -15,11 +16,11 @@ import yaml
 from lightning import Trainer
 from lightning.pytorch.callbacks import EarlyStopping, ModelCheckpoint
 from lightning.pytorch.loggers import Logger, WandbLogger
+from lightning.pytorch.strategies import DDPStrategy
 from loguru import logger
 
 from graphium.data.datamodule import BaseDataModule, MultitaskFromSmilesDataModule
 from graphium.finetuning.finetuning_architecture import FullGraphFinetuningNetwork
-from graphium.ipu.ipu_dataloader import IPUDataloaderOptions
 from graphium.ipu.ipu_utils import import_poptorch, load_ipu_options
 from graphium.nn.architectures import FullGraphMultiTaskNetwork
 from graphium.nn.utils import MupMixin
@@ -28,22 +29,20 @@ from graphium.trainer.predictor import PredictorModule
 from graphium.utils.command_line_utils import get_anchors_and_aliases, update_config
 
 # Graphium
-from graphium.utils.mup import set_base_shapes
+from graphium.utils.mup import meta_device_context, set_base_shapes
 from graphium.utils.spaces import DATAMODULE_DICT, GRAPHIUM_PRETRAINED_MODELS_DICT
 from graphium.utils import fs
 
 
-def get_accelerator(
-    config_acc: Union[omegaconf.DictConfig, Dict[str, Any]],
-) -> str:
+@lru_cache(maxsize=None)
+def _check_accelerator_available(accelerator_type: Optional[str]) -> None:
     """
-    Get the accelerator from the config file, and ensure that they are
-    consistant.
+    Ensure that the hardware for the accelerator is available.
+    The hardware does not change during a run, so the probe (which imports
+    poptorch on IPUs) is cached and only done once per accelerator type.
+    A failed check raises and is therefore never cached.
     """
 
-    # Get the accelerator type
-    accelerator_type = config_acc["type"]
-
     # Get the GPU info
     if (accelerator_type == "gpu") and (not torch.cuda.is_available()):
         raise ValueError(f"GPUs selected, but GPUs are not available on this device")
@@ -60,6 +59,19 @@ def get_accelerator(
                 "IPUOF_VIPU_API_HOST environment variables are set."
             )
 
+
+def get_accelerator(
+    config_acc: Union[omegaconf.DictConfig, Dict[str, Any]],
+) -> str:
+    """
+    Get the accelerator from the config file, and ensure that they are
+    consistant.
+    """
+
+    # Get the accelerator type
+    accelerator_type = config_acc["type"]
+    _check_accelerator_available(accelerator_type)
+
     # Fall on cpu at the end
     if accelerator_type is None:
         accelerator_type = "cpu"
@@ -83,6 +95,48 @@ def _get_ipu_opts(config: Union[omegaconf.DictConfig, Dict[str, Any]]) -> Tuple[
     return ipu_opts, ipu_inference_opts
 
 
+@lru_cache(maxsize=None)
+def _load_ipu_options_cached(
+    ipu_opts: Optional[Tuple[str, ...]],
+    seed: Optional[int],
+    model_name: Optional[str],
+    gradient_accumulation: Optional[int],
+    precision: Optional[str],
+    ipu_inference_opts: Optional[Tuple[str, ...]],
+) -> Tuple["poptorch.Options", "poptorch.Options"]:
+    r"""
+    Cached version of `load_ipu_options`, keyed by its (hashable) arguments.
+    """
+    return load_ipu_options(
+        ipu_opts=None if ipu_opts is None else list(ipu_opts),
+        seed=seed,
+        model_name=model_name,
+        gradient_accumulation=gradient_accumulation,
+        precision=precision,
+        ipu_inference_opts=None if ipu_inference_opts is None else list(ipu_inference_opts),
+    )
+
+
+def _load_ipu_options_from_config(
+    config: Union[omegaconf.DictConfig, Dict[str, Any]]
+) -> Tuple["poptorch.Options", "poptorch.Options"]:
+    r"""
+    Load the IPU training and inference options from the main YAML config.
+    The options are parsed once per config, and both `load_datamodule` and `load_trainer`
+    receive their own copy of them.
+    """
+    ipu_opts, ipu_inference_opts = _get_ipu_opts(config)
+    training_opts, inference_opts = _load_ipu_options_cached(
+        ipu_opts=None if ipu_opts is None else tuple(ipu_opts),
+        seed=config["constants"]["seed"],
+        model_name=config["constants"]["name"],
+        gradient_accumulation=config["trainer"]["trainer"].get("accumulate_grad_batches", None),
+        precision=config["trainer"]["trainer"].get("precision"),
+        ipu_inference_opts=None if ipu_inference_opts is None else tuple(ipu_inference_opts),
+    )
+    return deepcopy(training_opts), deepcopy(inference_opts)
+
+
 def load_datamodule(
     config: Union[omegaconf.DictConfig, Dict[str, Any]], accelerator_type: str
 ) -> BaseDataModule:
@@ -98,34 +152,32 @@ def load_datamodule(
         datamodule: The datamodule used to process and load the data
     """
 
-    cfg_data = config["datamodule"]["args"]
+    # Shallow copy, such that the options popped below are left in the caller's config
+    cfg_data = dict(config["datamodule"]["args"])
+
+    # The missing options take the defaults of the datamodule
+    logger.info(
+        f"Dataloader workers: num_workers={cfg_data.get('num_workers')}, "
+        f"persistent_workers={cfg_data.get('persistent_workers')}, "
+        f"prefetch_factor={cfg_data.get('prefetch_factor')}"
+    )
 
     # Instanciate the datamodule
     module_class = DATAMODULE_DICT[config["datamodule"]["module_type"]]
 
     if accelerator_type != "ipu":
         datamodule = module_class(
-            **config["datamodule"]["args"],
+            **cfg_data,
         )
         return datamodule
 
     # IPU specific adjustments
     else:
-        ipu_opts, ipu_inference_opts = _get_ipu_opts(config)
-
-        # Default empty values for the IPU configurations
-        ipu_training_opts = None
+        from graphium.ipu.ipu_dataloader import IPUDataloaderOptions
 
         ipu_dataloader_training_opts = cfg_data.pop("ipu_dataloader_training_opts", {})
         ipu_dataloader_inference_opts = cfg_data.pop("ipu_dataloader_inference_opts", {})
-        ipu_training_opts, ipu_inference_opts = load_ipu_options(
-            ipu_opts=ipu_opts,
-            seed=config["constants"]["seed"],
-            model_name=config["constants"]["name"],
-            gradient_accumulation=config["trainer"]["trainer"].get("accumulate_grad_batches", None),
-            ipu_inference_opts=ipu_inference_opts,
-            precision=config["trainer"]["trainer"].get("precision"),
-        )
+        ipu_training_opts, ipu_inference_opts = _load_ipu_options_from_config(config)
         # Define the Dataloader options for the IPU on the training sets
         bz_train = cfg_data["batch_size_training"]
         ipu_dataloader_training_opts = IPUDataloaderOptions(
@@ -145,7 +197,7 @@ def load_datamodule(
             ipu_inference_opts=ipu_inference_opts,
             ipu_dataloader_training_opts=ipu_dataloader_training_opts,
             ipu_dataloader_inference_opts=ipu_dataloader_inference_opts,
-            **config["datamodule"]["args"],
+            **cfg_data,
         )
 
         return datamodule
@@ -164,15 +216,15 @@ def load_metrics(config: Union[omegaconf.DictConfig, Dict[str, Any]]) -> Dict[st
     cfg_metrics = config.get("metrics", None)
     if cfg_metrics is None:
         return task_metrics
-    cfg_metrics = {key: deepcopy(value) for key, value in config["metrics"].items()}
-    # Wrap every metric in the class `MetricWrapper` to standardize them
-    for task in cfg_metrics:
+    # Wrap every metric in the class `MetricWrapper` to standardize them.
+    # The config is only read, so it does not need to be copied.
+    for task, task_cfg_metrics in cfg_metrics.items():
         task_metrics[task] = {}
-        if cfg_metrics[task] is None:
-            cfg_metrics[task] = []
-        for this_metric in cfg_metrics[task]:
-            name = this_metric.pop("name")
-            task_metrics[task][name] = MetricWrapper(**this_metric)
+        if task_cfg_metrics is None:
+            continue
+        for this_metric in task_cfg_metrics:
+            metric_kwargs = {key: value for key, value in this_metric.items() if key != "name"}
+            task_metrics[task][this_metric["name"]] = MetricWrapper(**metric_kwargs)
     return task_metrics
 
 
@@ -202,26 +254,25 @@ def load_architecture(
     else:
         raise ValueError(f"Unsupported model_type=`{model_type}`")
 
-    # Prepare the various kwargs
-    pe_encoders_kwargs = (
-        dict(cfg_arch["pe_encoders"]) if cfg_arch.get("pe_encoders", None) is not None else None
-    )
-
-    pre_nn_kwargs = dict(cfg_arch["pre_nn"]) if cfg_arch["pre_nn"] is not None else None
-    pre_nn_edges_kwargs = dict(cfg_arch["pre_nn_edges"]) if cfg_arch["pre_nn_edges"] is not None else None
-    gnn_kwargs = dict(cfg_arch["gnn"])
-    graph_output_nn_kwargs = (
-        dict(cfg_arch["graph_output_nn"]) if cfg_arch["graph_output_nn"] is not None else None
-    )
-    task_heads_kwargs = (
-        cfg_arch["task_heads"] if cfg_arch["task_heads"] is not None else None
-    )  # This is of type ListConfig containing TaskHeadParams
+    # Prepare the various kwargs. The sub-configs are converted to plain containers in a single pass.
+    # The task heads are converted with `to_object`, since they can be structured `TaskHeadParams`.
+    arch_containers = {}
+    for key, value in cfg_arch.items():
+        if not isinstance(value, omegaconf.Container):
+            arch_containers[key] = value
+        elif key == "task_heads":
+            arch_containers[key] = omegaconf.OmegaConf.to_object(value)
+        else:
+            arch_containers[key] = omegaconf.OmegaConf.to_container(value, resolve=True)
+    pe_encoders_kwargs = arch_containers.get("pe_encoders", None)
+    pre_nn_kwargs = arch_containers["pre_nn"]
+    pre_nn_edges_kwargs = arch_containers["pre_nn_edges"]
+    gnn_kwargs = arch_containers["gnn"]
+    graph_output_nn_kwargs = arch_containers["graph_output_nn"]
+    task_heads_kwargs = arch_containers["task_heads"]
 
     # Initialize the input dimension for the positional encoders
     if pe_encoders_kwargs is not None:
-        pe_encoders_kwargs = dict(pe_encoders_kwargs)
-        for encoder in pe_encoders_kwargs["encoders"]:
-            pe_encoders_kwargs["encoders"][encoder] = dict(pe_encoders_kwargs["encoders"][encoder])
         pe_encoders_kwargs.setdefault(
             "in_dims", in_dims
         )  # set the input dimensions of all pe with info from the data-module
@@ -233,7 +284,6 @@ def load_architecture(
     if pe_out_dim is not None:
         in_dim += pe_out_dim
     if pre_nn_kwargs is not None:
-        pre_nn_kwargs = dict(pre_nn_kwargs)
         pre_nn_kwargs.setdefault("in_dim", in_dim)
     else:
         gnn_kwargs.setdefault("in_dim", in_dim)
@@ -243,14 +293,10 @@ def load_architecture(
     if edge_pe_out_dim is not None:
         edge_in_dim += edge_pe_out_dim
     if pre_nn_edges_kwargs is not None:
-        pre_nn_edges_kwargs = dict(pre_nn_edges_kwargs)
         pre_nn_edges_kwargs.setdefault("in_dim", edge_in_dim)
     else:
         gnn_kwargs.setdefault("in_dim", edge_in_dim)
 
-    # Set the parameters for the full network
-    task_heads_kwargs = omegaconf.OmegaConf.to_object(task_heads_kwargs)
-
     # Set all the input arguments for the model
     model_kwargs = dict(
         gnn_kwargs=gnn_kwargs,
@@ -302,6 +348,15 @@ def load_predictor(
     else:
         predictor_class = PredictorModule
 
+    # Scale the model kwargs before building the predictor, so that the model is only built once.
+    # The unscaled model is only needed for its kwargs, so its parameters are not allocated.
+    mup_scale_factor = config["architecture"].pop("mup_scale_factor", None)
+    if mup_scale_factor is not None and mup_scale_factor != 1:
+        with meta_device_context():
+            unscaled_model = model_class(**model_kwargs)
+        model_kwargs = unscaled_model.scale_kwargs(scale_factor=mup_scale_factor)
+        del unscaled_model
+
     cfg_pred = dict(deepcopy(config["predictor"]))
     predictor = predictor_class(
         model_class=model_class,
@@ -313,19 +368,6 @@ def load_predictor(
         **cfg_pred,
     )
 
-    mup_scale_factor = config["architecture"].pop("mup_scale_factor", None)
-
-    if mup_scale_factor is not None and mup_scale_factor != 1:
-        unscaled_model = predictor.model
-        scaled_model_kwargs = unscaled_model.scale_kwargs(scale_factor=mup_scale_factor)
-        del predictor
-        predictor = predictor_class(
-            model_class=model_class,
-            model_kwargs=scaled_model_kwargs,
-            metrics=metrics,
-            **cfg_pred,
-        )
-
     # mup base shapes
     mup_base_path = config["architecture"].pop("mup_base_path", None)
     predictor = load_mup(mup_base_path, predictor)
@@ -344,7 +386,9 @@ def load_mup(mup_base_path: str, predictor: PredictorModule) -> PredictorModule:
         raise TypeError("load_mup can only be applied to models that use the MupMixin")
 
     if mup_base_path is None:
-        base = model.__class__(**model.make_mup_base_kwargs(divide_factor=2))
+        # Only the shapes of the base model are used, so its parameters are not allocated
+        with meta_device_context():
+            base = model.__class__(**model.make_mup_base_kwargs(divide_factor=2))
     elif mup_base_path.endswith(".ckpt"):
         base = predictor.__class__.load_from_checkpoint(mup_base_path, map_location="cpu")
     elif mup_base_path.endswith(".yaml"):
@@ -355,6 +399,33 @@ def load_mup(mup_base_path: str, predictor: PredictorModule) -> PredictorModule:
     return predictor
 
 
+def _load_ddp_strategy(strategy: Union[str, Mapping[str, Any]]) -> Union[str, Mapping[str, Any], DDPStrategy]:
+    """
+    Build the `DDPStrategy` for the `"ddp"` strategy, with the gradients used as views of the
+    all-reduce buckets, which avoids copying them at every step.
+    The strategy can also be given as a dict, e.g. `{"name": "ddp", "static_graph": True}`,
+    to pass other options to the `DDPStrategy`. Any other strategy is returned unchanged.
+
+    Parameters:
+        strategy: The strategy from the `trainer` config
+    Returns:
+        strategy: The strategy to pass to the `Trainer`
+    """
+    if isinstance(strategy, str):
+        if strategy != "ddp":
+            return strategy
+        strategy = {"name": strategy}
+    elif not isinstance(strategy, Mapping):
+        return strategy
+
+    strategy = dict(strategy)
+    name = strategy.pop("name", "ddp")
+    if name != "ddp":
+        raise ValueError(f"Only the 'ddp' strategy accepts options, got '{name}'")
+    strategy.setdefault("gradient_as_bucket_view", True)
+    return DDPStrategy(**strategy)
+
+
 def load_trainer(
     config: Union[omegaconf.DictConfig, Dict[str, Any]],
     accelerator_type: str,
@@ -369,21 +440,14 @@ def load_trainer(
     Returns:
         trainer: the trainer module
     """
-    cfg_trainer = deepcopy(config["trainer"])
+    # Only the `trainer` sub-dict is modified below, no need to deep-copy the full config
+    cfg_trainer = dict(config["trainer"])
+    cfg_trainer["trainer"] = dict(cfg_trainer["trainer"])
 
     # Define the IPU plugin if required
     strategy = cfg_trainer["trainer"].pop("strategy", "auto")
     if accelerator_type == "ipu":
-        ipu_opts, ipu_inference_opts = _get_ipu_opts(config)
-
-        training_opts, inference_opts = load_ipu_options(
-            ipu_opts=ipu_opts,
-            ipu_inference_opts=ipu_inference_opts,
-            seed=config["constants"]["seed"],
-            model_name=config["constants"]["name"],
-            gradient_accumulation=config["trainer"]["trainer"].get("accumulate_grad_batches", None),
-            precision=config["trainer"]["trainer"].get("precision"),
-        )
+        training_opts, inference_opts = _load_ipu_options_from_config(config)
 
         if strategy != "auto":
             raise ValueError("IPUs selected, but strategy is not set to 'auto'")
@@ -391,6 +455,8 @@ def load_trainer(
         from lightning_graphcore import IPUStrategy
 
         strategy = IPUStrategy(training_opts=training_opts, inference_opts=inference_opts)
+    else:
+        strategy = _load_ddp_strategy(strategy)
 
     # Get devices
     devices = cfg_trainer["trainer"].pop("devices", 1)
@@ -489,7 +555,7 @@ def load_accelerator(config: Union[omegaconf.DictConfig, Dict[str, Any]]) -> Tup
 def load_config_override(
     config: Union[omegaconf.DictConfig, Dict[str, Any]], main_dir: Optional[Union[str, os.PathLike]] = None
 ) -> Dict[str, Any]:
-    config = deepcopy(config)
+    # `merge_dicts` only modifies the freshly loaded `cfg_override`, so `config` is not copied
     config_override_path = config["constants"].get("config_override", None)
     if config_override_path is not None:
         if main_dir is not None:
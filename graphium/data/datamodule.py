@@ -5,13 +5,15 @@ from os import PathLike as Path
 
 from dataclasses import dataclass
 
+import io
 import os
-from functools import partial
+from functools import partial, lru_cache
+from itertools import compress
+from concurrent.futures import ThreadPoolExecutor
 import importlib.resources
 import zipfile
 from copy import deepcopy
 import time
-import gc
 
 import platformdirs
 import re
@@ -28,20 +30,21 @@ from tqdm import tqdm
 import os.path as osp
 from fastparquet import ParquetFile
 
-from sklearn.model_selection import train_test_split
-
 import lightning
 from lightning.pytorch.trainer.states import RunningStage
+from lightning_utilities.core.apply_func import apply_to_collection
 
 import torch
 from torch.utils.data.dataloader import DataLoader, Dataset
 from torch.utils.data import Subset
+from torch_geometric.data import Data
 
 from graphium.utils import fs
 from graphium.features import (
     mol_to_graph_dict,
     GraphDict,
     mol_to_pyggraph,
+    get_mol_feature_dims,
 )
 
 from graphium.data.sampler import DatasetSubSampler
@@ -58,9 +61,6 @@ import graphium.data.dataset as Datasets
 from graphium.data.normalization import LabelNormalization
 from graphium.data.multilevel_utils import extract_labels
 
-torch.multiprocessing.set_sharing_strategy("file_system")
-
-
 PCQM4M_meta = {
     "num tasks": 1,
     "eval metric": "mae",
@@ -78,14 +78,68 @@ PCQM4M_meta = {
     "version": 1,
 }
 
-PCQM4Mv2_meta = deepcopy(PCQM4M_meta)
-PCQM4Mv2_meta.update(
-    {
-        "download_name": "pcqm4m-v2",
-        "url": "https://dgl-data.s3-accelerate.amazonaws.com/dataset/OGB-LSC/pcqm4m-v2.zip",  # TODO: Allow PyG
-        "version": 2,
-    }
-)
+PCQM4Mv2_meta = {
+    **PCQM4M_meta,
+    "download_name": "pcqm4m-v2",
+    "url": "https://dgl-data.s3-accelerate.amazonaws.com/dataset/OGB-LSC/pcqm4m-v2.zip",  # TODO: Allow PyG
+    "version": 2,
+}
+
+# Maximum number of dataloader workers used with `num_workers=-1`
+MAX_AUTO_NUM_WORKERS = 8
+
+# Data tag of an sdf record, such as `> <score>` or `>  <score>  (1)`
+_SDF_TAG_PATTERN = re.compile(r"^>\s*<([^>]+)>")
+
+
+def _save_featurized_shard(shard_index: int, dataset: Datasets.MultitaskDataset, folder: str) -> None:
+    """
+    Save the features and labels of the shard `shard_index`, made of 1000 consecutive data of `dataset`,
+    to a single file, read back by `MultitaskDataset.load_graph_from_index`. The file starts with
+    the number of data `n` and the `n + 1` byte offsets of the data, as little-endian int64, followed
+    by the data serialized with `torch.save`. The data of the shard is only gathered here, such that
+    a single shard at a time is held in memory by each thread.
+    """
+    start = shard_index * 1000
+    blobs = []
+    for index in range(start, min(start + 1000, len(dataset))):
+        datum = dataset[index]
+        buffer = io.BytesIO()
+        torch.save(
+            {"graph_with_features": datum["features"], "labels": datum["labels"]},
+            buffer,
+            pickle_protocol=4,
+        )
+        # A view of the serialized bytes, without copying them out of the buffer
+        blobs.append(buffer.getbuffer())
+
+    header_size = 8 * (len(blobs) + 2)
+    offsets = np.zeros(len(blobs) + 1, dtype="<i8")
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    offsets += header_size
+
+    filename = os.path.join(folder, format(shard_index, "04d") + ".pt")
+    with open(filename, "wb") as f:
+        f.write(np.array([len(blobs)], dtype="<i8").tobytes())
+        f.write(offsets.tobytes())
+        f.writelines(blobs)
+
+
+class _GraphiumCollate:
+    """
+    `graphium_collate_fn` with bound keyword arguments, which can be updated through `keywords`
+    like a `functools.partial`. Unlike a partial with a custom `__name__`, it carries no
+    instance `__dict__`, so it is lighter to pickle to each dataloader worker.
+    """
+
+    __slots__ = ("keywords",)
+    __name__ = graphium_collate_fn.__name__
+
+    def __init__(self, **keywords):
+        self.keywords = keywords
+
+    def __call__(self, elements):
+        return graphium_collate_fn(elements, **self.keywords)
 
 
 class BaseDataModule(lightning.LightningDataModule):
@@ -96,9 +150,13 @@ class BaseDataModule(lightning.LightningDataModule):
         batch_size_per_pack: Optional[int] = None,
         num_workers: int = 0,
         pin_memory: bool = True,
-        persistent_workers: bool = False,
+        persistent_workers: Optional[bool] = None,
         multiprocessing_context: Optional[str] = None,
         collate_fn: Optional[Callable] = None,
+        prefetch_factor: Optional[int] = 2,
+        pin_memory_device: str = "",
+        sharing_strategy: Optional[str] = "file_system",
+        csv_engine: Optional[str] = None,
     ):
         """
         base dataset module for all datasets (to be inherented)
@@ -106,11 +164,27 @@ class BaseDataModule(lightning.LightningDataModule):
         Parameters:
             batch_size_training: batch size for training
             batch_size_inference: batch size for inference
-            num_workers: number of workers for data loading
+            num_workers: number of workers for data loading. Use -1 to use all the available cores,
+                up to `MAX_AUTO_NUM_WORKERS`
             pin_memory: whether to pin memory
-            persistent_workers: whether to use persistent workers
+            persistent_workers: whether to keep the workers alive between epochs, instead of
+                re-spawning them and pickling the dataset at every epoch. If `None`, they are kept
+                alive whenever `num_workers>0`. Ignored when `num_workers=0`
             multiprocessing_context: multiprocessing context for data worker creation
             collate_fn: collate function for batching
+            prefetch_factor: number of batches loaded in advance by each worker.
+                Higher values hide more of the loading latency, but hold
+                `num_workers * prefetch_factor` batches in memory, which can run out of memory
+                with large batches. Ignored when `num_workers=0`. If `None`, the pytorch default is used.
+            pin_memory_device: device on which to pin the memory when `pin_memory=True`, e.g. `"cuda:1"`,
+                such that the batches can be moved to that device with `.to(device, non_blocking=True)`.
+                If empty, the pytorch default is used.
+            sharing_strategy: strategy used by `torch.multiprocessing` to share the tensors between the
+                data workers, set when the datamodule is created. `"file_system"` avoids running out of
+                file descriptors with many workers. If `None`, the strategy is left unchanged.
+            csv_engine: parser used by `pd.read_csv` for the csv and tsv data files, e.g. `"pyarrow"`,
+                whose multi-threaded parser is faster on large files, but can infer different dtypes
+                and missing values. If `None`, the default pandas parser is used.
         """
         super().__init__()
 
@@ -130,6 +204,13 @@ class BaseDataModule(lightning.LightningDataModule):
         self.pin_memory = pin_memory
         self.persistent_workers = persistent_workers
         self.multiprocessing_context = multiprocessing_context
+        self.prefetch_factor = prefetch_factor
+        self.pin_memory_device = pin_memory_device
+        self.csv_engine = csv_engine
+        if (sharing_strategy is not None) and (
+            torch.multiprocessing.get_sharing_strategy() != sharing_strategy
+        ):
+            torch.multiprocessing.set_sharing_strategy(sharing_strategy)
 
         self.collate_fn = self.get_collate_fn(collate_fn)
 
@@ -194,10 +275,7 @@ class BaseDataModule(lightning.LightningDataModule):
     def get_collate_fn(self, collate_fn):
         if collate_fn is None:
             # Some values become `inf` when changing data type. `mask_nan` deals with that
-            collate_fn = partial(
-                graphium_collate_fn, mask_nan=0, batch_size_per_pack=self.batch_size_per_pack
-            )
-            collate_fn.__name__ = graphium_collate_fn.__name__
+            collate_fn = _GraphiumCollate(mask_nan=0, batch_size_per_pack=self.batch_size_per_pack)
 
         return collate_fn
 
@@ -231,8 +309,14 @@ class BaseDataModule(lightning.LightningDataModule):
         get the number of workers to use
         """
         if self.num_workers == -1:
-            num_workers = os.cpu_count()
+            # Only count the cores this process can run on, e.g. within a container or a job scheduler
+            if hasattr(os, "sched_getaffinity"):
+                num_workers = len(os.sched_getaffinity(0))
+            else:
+                num_workers = os.cpu_count()
             num_workers = num_workers if num_workers is not None else 0
+            # More workers contend for the inter-process queue, and rarely increase the throughput
+            num_workers = min(num_workers, MAX_AUTO_NUM_WORKERS)
         else:
             num_workers = self.num_workers
         return num_workers
@@ -278,6 +362,7 @@ class BaseDataModule(lightning.LightningDataModule):
         return df
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def _get_data_file_type(path):
         # Extract the extension
         name, ext = os.path.splitext(path)
@@ -307,6 +392,7 @@ class BaseDataModule(lightning.LightningDataModule):
         """
         Get the columns of a table without reading all the data.
         Might be slow to decompress the file if the file is compressed.
+        The columns are cached per file, and local files are read again when they are modified.
 
         Parameters:
             path: path to the table file
@@ -314,47 +400,192 @@ class BaseDataModule(lightning.LightningDataModule):
         Returns:
             List[str]: the column names
         """
+        mtime = os.path.getmtime(path) if os.path.isfile(path) else None
+        return list(BaseDataModule._get_table_columns_cached(path, mtime))
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _get_table_columns_cached(path: str, mtime: Optional[float]) -> Tuple[str, ...]:
+        """
+        Cached implementation of `_get_table_columns`. The `mtime` is only part of the cache key.
+        """
 
         datafile_type = BaseDataModule._get_data_file_type(path)
 
         if datafile_type == "parquet":
-            # Read the schema of a parquet file
-            file = ParquetFile(path)
-            schema = file.pandas_metadata["columns"]
-            column_names = [s["name"] for s in schema if s["name"] is not None]
+            column_names = BaseDataModule._get_parquet_columns(ParquetFile(path))
         elif datafile_type == "sdf":
-            df = BaseDataModule._read_sdf(path, max_num_mols=5, discard_invalud=True, n_jobs=1)
-            column_names = df.columns
+            column_names = BaseDataModule._get_sdf_columns(path)
         elif datafile_type in ["csv", "tsv"]:
             # Read the schema of a csv / tsv file
             df = BaseDataModule._read_csv(path, nrows=5)
             column_names = df.columns
-        return column_names
+        return tuple(column_names)
 
     @staticmethod
-    def _read_parquet(path, **kwargs):
+    def _get_sdf_columns(
+        path: str, smiles_column: str = "smiles", mol_col_name: str = "_rdkit_molecule_obj"
+    ) -> List[str]:
+        """
+        Get the columns of an sdf file from the data tags `> <TAG>` of its first record,
+        without parsing any molecule.
+
+        Parameters:
+            path: path to the sdf file, possibly compressed
+            smiles_column: name of the smiles column added by `_read_sdf`
+            mol_col_name: name of the molecule column added by `_read_sdf`
+
+        Returns:
+            List[str]: the column names
+        """
+        tags = []
+        with fsspec.open(path, mode="rt", compression="infer") as file:
+            for line in file:
+                if line.startswith("$$$$"):  # End of the first record
+                    break
+                match = _SDF_TAG_PATTERN.match(line)
+                if match is not None:
+                    tags.append(match.group(1))
+        return [smiles_column] + tags + [mol_col_name]
+
+    @staticmethod
+    def _get_parquet_columns(file: ParquetFile) -> List[str]:
+        """
+        Get the columns of an opened parquet file from its schema.
+
+        Parameters:
+            file: the parquet file
+
+        Returns:
+            List[str]: the column names
+        """
+        pandas_metadata = file.pandas_metadata
+        if "columns" not in pandas_metadata:
+            # Written without pandas, so there are no index columns to skip
+            return list(file.columns)
+        return [s["name"] for s in pandas_metadata["columns"] if s["name"] is not None]
+
+    @staticmethod
+    def _pop_parquet_columns(kwargs: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        Pop the columns to read from the `pd.read_csv`-like `kwargs`, and the arguments only useful for csv.
+
+        Parameters:
+            kwargs: keyword arguments for reading the file, modified in-place
+
+        Returns:
+            The columns to read, or `None` for all the columns
+        """
         kwargs.pop("dtype", None)  # Only useful for csv
-        column_names = BaseDataModule._get_table_columns(path)
 
         # Change the 'usecols' parameter to 'columns'
         columns = kwargs.pop("columns", None)
         if "usecols" in kwargs.keys():
             assert columns is None, "Ambiguous value of `columns`"
             columns = kwargs.pop("usecols")
+        return columns
+
+    @staticmethod
+    def _check_parquet_columns(file: ParquetFile, columns: Optional[List[str]]) -> List[str]:
+        """
+        Check that the columns exist in the parquet file
+
+        Parameters:
+            file: the parquet file
+            columns: the columns to read, or `None` for all the columns
+
+        Returns:
+            List[str]: the columns to read
+        """
+        column_names = BaseDataModule._get_parquet_columns(file)
         if columns is None:
             columns = column_names
         for column in columns:
             assert (
                 column in column_names
             ), f"Column `{column}` is not in the parquet file with columns {column_names}"
+        return list(columns)
+
+    @staticmethod
+    def _read_parquet(path, **kwargs):
+        # Open the file once, such that the footer is parsed a single time for the schema and the data
+        file = ParquetFile(path)
+        columns = BaseDataModule._check_parquet_columns(file, BaseDataModule._pop_parquet_columns(kwargs))
+
+        # Read all the columns in a single pass
+        df = file.to_pandas(columns=columns, **kwargs)
+
+        return BaseDataModule._parquet_floats_to_float16(df, columns)
+
+    @staticmethod
+    def _read_parquet_sample(
+        paths: List[str], sample_size: int, seed: Optional[int] = None, **kwargs
+    ) -> pd.DataFrame:
+        """
+        Randomly sample rows from the concatenation of parquet files, while only reading
+        the row groups that contain sampled rows.
+        The rows, their order and their index are the same as when sampling the concatenated
+        files with `pd.DataFrame.sample(n=sample_size, random_state=seed)`.
+
+        Parameters:
+            paths: paths to the parquet files, in the order of their concatenation
+            sample_size: the number of rows to sample
+            seed: seed of the random sampling
+            kwargs: keyword arguments for reading the files
+
+        Returns:
+            pd.DataFrame: the sampled rows
+        """
+        files = [ParquetFile(path) for path in paths]
+        requested_columns = BaseDataModule._pop_parquet_columns(kwargs)
+        columns = [BaseDataModule._check_parquet_columns(file, requested_columns) for file in files][0]
+
+        # List the row groups of all the files, with the global position of their first row
+        row_groups = [(file, ii) for file in files for ii in range(len(file.row_groups))]
+        num_rows = np.array([file.row_groups[ii].num_rows for file, ii in row_groups], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(num_rows)])
+
+        # Same sampling as `pd.DataFrame.sample`
+        random_state = np.random if seed is None else np.random.RandomState(seed)
+        positions = random_state.choice(offsets[-1], size=min(sample_size, offsets[-1]), replace=False)
+
+        # Without any sampled row, such as for empty files, return the empty frame with the right columns
+        if positions.size == 0:
+            df = files[0].to_pandas(columns=columns, **kwargs).iloc[:0]
+            df.index = pd.Index(positions)
+            return BaseDataModule._parquet_floats_to_float16(df, columns)
+
+        # Read only the row groups that contain sampled rows
+        groups = np.searchsorted(offsets, positions, side="right") - 1
+        selected = np.unique(groups)
+        dfs = []
+        for group in selected:
+            file, ii = row_groups[group]
+            dfs.append(file[ii].to_pandas(columns=columns, **kwargs))
+        df = pd.concat(dfs, ignore_index=True)
+
+        # Position of the sampled rows among the rows that were read
+        selected_offsets = np.concatenate([[0], np.cumsum(num_rows[selected])])
+        local_positions = positions - offsets[groups] + selected_offsets[np.searchsorted(selected, groups)]
+        df = df.take(local_positions)
+        df.index = pd.Index(positions)
+
+        return BaseDataModule._parquet_floats_to_float16(df, columns)
 
-        # Read the parquet file per column, and convert the data to float16 to reduce memory consumption
-        all_series = {}
-        progress = tqdm(columns)
-        for col in progress:
-            # Read single column
-            progress.set_description(f"Reading parquet column `{col}`")
-            this_series = pd.read_parquet(path, columns=[col], engine="fastparquet", **kwargs)[col]
+    @staticmethod
+    def _parquet_floats_to_float16(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        """
+        Convert the float columns read from a parquet file to float16 to reduce memory consumption
+
+        Parameters:
+            df: the dataframe read from the parquet file
+            columns: the columns to convert, if they are float
+
+        Returns:
+            pd.DataFrame: the dataframe with the converted columns
+        """
+        for col in columns:
+            this_series = df[col]
 
             # Check if the data is float
             first_elem = this_series.values[0]
@@ -367,20 +598,40 @@ class BaseDataModule(lightning.LightningDataModule):
             # Convert floats to float16
             if is_float:
                 if isinstance(first_elem, (np.ndarray, list)):
-                    this_series.update(
-                        pd.Series([np.asarray(elem).astype(np.float16) for elem in this_series])
+                    this_series = pd.Series(
+                        BaseDataModule._arrays_to_float16(this_series.values), index=this_series.index
                     )
                 else:
                     this_series = this_series.astype(np.float16)
 
-            all_series[col] = this_series
-            gc.collect()  # Reset memory after each column
-
-        # Merge columns into a dataframe
-        df = pd.concat(all_series, axis=1)
+            df[col] = this_series
 
         return df
 
+    @staticmethod
+    def _arrays_to_float16(values: Iterable) -> List[np.ndarray]:
+        """
+        Convert a sequence of float arrays to float16 with a single numpy cast on
+        their concatenation, instead of one cast per element.
+
+        Parameters:
+            values: sequence of arrays or lists of floats
+
+        Returns:
+            List[np.ndarray]: the float16 arrays, as views of a single contiguous buffer
+        """
+        try:
+            lengths = np.fromiter((len(elem) for elem in values), dtype=np.int64, count=len(values))
+        except TypeError:
+            # Some elements are not arrays (e.g. missing values), so convert them one by one
+            return [np.asarray(elem).astype(np.float16) for elem in values]
+
+        flat = np.concatenate(values).astype(np.float16, copy=False)
+        if np.all(lengths == lengths[0]):
+            # Fixed-length arrays are simply the rows of a 2D array
+            return list(flat.reshape((len(lengths), lengths[0]) + flat.shape[1:]))
+        return np.split(flat, np.cumsum(lengths)[:-1])
+
     @staticmethod
     def _read_sdf(path: str, mol_col_name: str = "_rdkit_molecule_obj", **kwargs):
         r"""
@@ -416,9 +667,10 @@ class BaseDataModule(lightning.LightningDataModule):
         # Read the SDF
         df = dm.read_sdf(path, as_df=True, **kwargs)
 
-        # Keep only the columns needed
+        # Keep only the columns needed. The molecule objects are dropped unless requested, since the
+        # featurization is computed from the smiles and the molecules would stay in memory during it.
         if usecols is not None:
-            df = df[usecols + [mol_cols]]
+            df = df[usecols]
 
         # Convert the dtypes
         if dtype is not None:
@@ -431,21 +683,60 @@ class BaseDataModule(lightning.LightningDataModule):
     @staticmethod
     def _glob(path: str) -> List[str]:
         """
-        glob a given path
+        glob a given path. The listing is cached, such that remote paths are only listed once,
+        until `_invalidate_glob_cache` is called.
         Parameters:
             path: path to glob
         Returns:
             List[str]: list of paths
         """
+        return list(BaseDataModule._glob_cached(path))
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _glob_cached(path: str) -> Tuple[str, ...]:
         files = dm.fs.glob(path)
-        files = [f.replace("file://", "") for f in files]
-        return files
+        return tuple(f.replace("file://", "") for f in files)
 
-    def _read_table(self, path: str, **kwargs) -> pd.DataFrame:
+    @staticmethod
+    def _invalidate_glob_cache():
+        """
+        Clear the cached listings of `_glob`, such that new or deleted files are seen
+        """
+        BaseDataModule._glob_cached.cache_clear()
+
+    def _read_file(self, path: str, **kwargs) -> pd.DataFrame:
+        """
+        read a single file with either _read_parquet, _read_sdf or _read_csv, depending on its type
+        Parameters:
+            path: path to the file to read
+            kwargs: keyword arguments for the reading function
+        Returns:
+            pd.DataFrame: the panda dataframe storing molecules
+        """
+        file_type = self._get_data_file_type(path)
+        if file_type == "parquet":
+            return self._read_parquet(path, **kwargs)
+        elif file_type == "sdf":  # support compressed sdf files
+            return self._read_sdf(path, **kwargs)
+        elif file_type in ["csv", "tsv"]:  # support compressed csv and tsv files
+            if self.csv_engine is not None:
+                kwargs.setdefault("engine", self.csv_engine)
+            return self._read_csv(path, **kwargs)
+        else:
+            raise ValueError(f"unsupported file `{path}`")
+
+    def _read_table(
+        self, path: str, sample_size: Optional[int] = None, seed: Optional[int] = None, **kwargs
+    ) -> pd.DataFrame:
         """
         a general read file function which determines if which function to use, either _read_csv or _read_parquet
         Parameters:
             path: path to the file to read
+            sample_size: if provided, the number of rows to randomly sample, as with
+                `pd.DataFrame.sample(n=sample_size, random_state=seed)`. For parquet files,
+                only the row groups containing sampled rows are read.
+            seed: seed for the random sampling
             kwargs: keyword arguments for pd.read_csv or pd.read_parquet
         Returns:
             pd.DataFrame: the panda dataframe storing molecules
@@ -454,22 +745,71 @@ class BaseDataModule(lightning.LightningDataModule):
         if len(files) == 0:
             raise FileNotFoundError(f"No such file or directory `{path}`")
 
-        if len(files) > 1:
-            files = tqdm(sorted(files), desc=f"Reading files at `{path}`")
-        dfs = []
+        if sample_size is not None:
+            files = sorted(files)
+            if all(self._get_data_file_type(file) == "parquet" for file in files):
+                return self._read_parquet_sample(files, sample_size=sample_size, seed=seed, **kwargs)
+            df = self._read_table(path, **kwargs)
+            return df.sample(n=min(sample_size, len(df)), random_state=seed)
+
+        if len(files) == 1:
+            df = self._read_file(files[0], **kwargs)
+            df.index = pd.RangeIndex(len(df))  # Same index as the concatenation below, without a copy
+            return df
+
+        # Read the files in parallel threads. The parsing is done by compiled code that releases the GIL,
+        # and the threads avoid pickling the dataframes back to the main process.
+        files = sorted(files)
+        read_file = partial(self._read_file, **kwargs)
+        with ThreadPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as executor:
+            dfs = list(
+                tqdm(executor.map(read_file, files), total=len(files), desc=f"Reading files at `{path}`")
+            )
+
+        return self._concat_tables(dfs)
+
+    def _get_table_length(self, path: str, **kwargs) -> int:
+        """
+        Get the number of rows of the tables at a path. The parquet files are not read,
+        as their number of rows is stored in their metadata.
+        Parameters:
+            path: path to the files to count the rows of
+            kwargs: keyword arguments to read the other files, e.g. `usecols`
+        Returns:
+            int: the total number of rows
+        """
+        files = self._glob(path)
+        if len(files) == 0:
+            raise FileNotFoundError(f"No such file or directory `{path}`")
+
+        length = 0
         for file in files:
-            file_type = self._get_data_file_type(file)
-            if file_type == "parquet":
-                df = self._read_parquet(file, **kwargs)
-            elif file_type == "sdf":  # support compressed sdf files
-                df = self._read_sdf(file, **kwargs)
-            elif file_type in ["csv", "tsv"]:  # support compressed csv and tsv files
-                df = self._read_csv(file, **kwargs)
+            if self._get_data_file_type(file) == "parquet":
+                length += ParquetFile(file).count()
             else:
-                raise ValueError(f"unsupported file `{file}`")
-            dfs.append(df)
+                length += len(self._read_file(file, **kwargs))
+        return length
 
-        return pd.concat(dfs, ignore_index=True)
+    @staticmethod
+    def _concat_tables(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Concatenate the rows of tables, column by column. Each column is removed from the
+        input tables once concatenated, such that the peak memory stays close to the size
+        of the result instead of twice its size.
+
+        Parameters:
+            dfs: the tables to concatenate, emptied in the process
+
+        Returns:
+            pd.DataFrame: the concatenated table, with a new index
+        """
+        columns = list(dfs[0].columns)
+        if (len(set(columns)) != len(columns)) or any(list(df.columns) != columns for df in dfs[1:]):
+            # Duplicated or mismatched columns are aligned by pandas
+            return pd.concat(dfs, ignore_index=True)
+
+        data = {col: pd.concat([df.pop(col) for df in dfs], ignore_index=True) for col in columns}
+        return pd.DataFrame(data, copy=False)
 
     def get_dataloader_kwargs(self, stage: RunningStage, shuffle: bool, **kwargs) -> Dict[str, Any]:
         """
@@ -498,9 +838,16 @@ class BaseDataModule(lightning.LightningDataModule):
         # Set default parameters
         loader_kwargs["shuffle"] = shuffle
         loader_kwargs["collate_fn"] = self.collate_fn
-        loader_kwargs["num_workers"] = self.get_num_workers
+        num_workers = self.get_num_workers
+        loader_kwargs["num_workers"] = num_workers
         loader_kwargs["pin_memory"] = self.pin_memory
-        loader_kwargs["persistent_workers"] = self.persistent_workers
+        if self.pin_memory and self.pin_memory_device:
+            loader_kwargs["pin_memory_device"] = self.pin_memory_device
+        # Worker-specific options are rejected by the `DataLoader` when loading in the main process
+        persistent_workers = True if self.persistent_workers is None else self.persistent_workers
+        loader_kwargs["persistent_workers"] = persistent_workers and (num_workers > 0)
+        if (num_workers > 0) and (self.prefetch_factor is not None):
+            loader_kwargs["prefetch_factor"] = self.prefetch_factor
         loader_kwargs["multiprocessing_context"] = self.multiprocessing_context
 
         # Update from provided parameters
@@ -540,6 +887,23 @@ class BaseDataModule(lightning.LightningDataModule):
 
         return loader
 
+    def transfer_batch_to_device(self, batch: Any, device: torch.device, dataloader_idx: int) -> Any:
+        r"""
+        Move a batch to the device. Lightning only copies the tensors asynchronously, and moves
+        the pyg graphs with a blocking `.to(device)`. Here, the pyg graphs are also copied with
+        `non_blocking=True` on CUDA, so that the copy from the pinned memory overlaps with the computation.
+        Parameters:
+            batch: The batch from the dataloader
+            device: The device to move the batch to
+            dataloader_idx: The index of the dataloader of the batch
+        Returns:
+            The batch on the device
+        """
+        non_blocking = torch.device(device).type == "cuda"
+        return apply_to_collection(
+            batch, (torch.Tensor, Data), lambda data: data.to(device, non_blocking=non_blocking)
+        )
+
     def get_max_num_nodes_datamodule(self, stages: Optional[List[str]] = None) -> int:
         """
         Get the maximum number of nodes across all datasets from the datamodule
@@ -553,46 +917,7 @@ class BaseDataModule(lightning.LightningDataModule):
         Returns:
             max_num_nodes: The maximum number of nodes across all datasets from the datamodule
         """
-
-        allowed_stages = ["train", "val", "test", "predict"]
-        if stages is None:
-            stages = allowed_stages
-        for stage in stages:
-            assert stage in allowed_stages, f"stage value `{stage}` not allowed."
-
-        max_num_nodes = 0
-        # Max number of nodes in the training dataset
-        if (self.train_ds is not None) and ("train" in stages):
-            logger.info("Max num nodes being calcuated train")
-            max_num_nodes = max(max_num_nodes, self.train_ds.max_num_nodes_per_graph)
-
-        # Max number of nodes in the validation dataset
-        if (
-            (self.val_ds is not None)
-            and ("val" in stages)
-            and (self.val_ds.max_num_nodes_per_graph is not None)
-        ):
-            logger.info("Max num nodes being calcuated val")
-            max_num_nodes = max(max_num_nodes, self.val_ds.max_num_nodes_per_graph)
-
-        # Max number of nodes in the test dataset
-        if (
-            (self.test_ds is not None)
-            and ("test" in stages)
-            and (self.test_ds.max_num_nodes_per_graph is not None)
-        ):
-            logger.info("Max num nodes being calcuated test")
-            max_num_nodes = max(max_num_nodes, self.test_ds.max_num_nodes_per_graph)
-
-        # Max number of nodes in the predict dataset
-        if (
-            (self.predict_ds is not None)
-            and ("predict" in stages)
-            and (self.predict_ds.max_num_nodes_per_graph is not None)
-        ):
-            max_num_nodes = max(max_num_nodes, self.predict_ds.max_num_nodes_per_graph)
-
-        return max_num_nodes
+        return self._get_max_per_graph_datamodule("max_num_nodes_per_graph", stages)
 
     def get_max_num_edges_datamodule(self, stages: Optional[List[str]] = None) -> int:
         """
@@ -607,47 +932,33 @@ class BaseDataModule(lightning.LightningDataModule):
         Returns:
             max_num_edges: The maximum number of edges across all datasets from the datamodule
         """
+        return self._get_max_per_graph_datamodule("max_num_edges_per_graph", stages)
 
-        allowed_stages = ["train", "val", "test", "predict"]
-        if stages is None:
-            stages = allowed_stages
-        for stage in stages:
-            assert stage in allowed_stages, f"stage value `{stage}` not allowed."
-
-        max_num_edges = 0
-        # Max number of nodes/edges in the training dataset
-        if (
-            (self.train_ds is not None)
-            and ("train" in stages)
-            and (self.train_ds.max_num_edges_per_graph is not None)
-        ):
-            max_num_edges = max(max_num_edges, self.train_ds.max_num_edges_per_graph)
-
-        # Max number of nodes/edges in the validation dataset
-        if (
-            (self.val_ds is not None)
-            and ("val" in stages)
-            and (self.val_ds.max_num_edges_per_graph is not None)
-        ):
-            max_num_edges = max(max_num_edges, self.val_ds.max_num_edges_per_graph)
+    def _get_max_per_graph_datamodule(self, attr: str, stages: Optional[List[str]] = None) -> int:
+        """
+        Get the maximum of a per-graph dataset attribute across the datasets of the given stages
 
-        # Max number of nodes/edges in the test dataset
-        if (
-            (self.test_ds is not None)
-            and ("test" in stages)
-            and (self.test_ds.max_num_edges_per_graph is not None)
-        ):
-            max_num_edges = max(max_num_edges, self.test_ds.max_num_edges_per_graph)
+        Parameters:
+            attr: The dataset attribute, either "max_num_nodes_per_graph" or "max_num_edges_per_graph"
+            stages: The stages from which to extract the maximum. If None, all stages are considered.
 
-        # Max number of nodes/edges in the predict dataset
-        if (
-            (self.predict_ds is not None)
-            and ("predict" in stages)
-            and (self.predict_ds.max_num_edges_per_graph is not None)
-        ):
-            max_num_edges = max(max_num_edges, self.predict_ds.max_num_edges_per_graph)
+        Returns:
+            The maximum across the datasets, or 0 if no dataset is available
+        """
+        stage_datasets = {
+            "train": self.train_ds,
+            "val": self.val_ds,
+            "test": self.test_ds,
+            "predict": self.predict_ds,
+        }
+        if stages is None:
+            stages = stage_datasets.keys()
+        for stage in stages:
+            assert stage in stage_datasets, f"stage value `{stage}` not allowed."
 
-        return max_num_edges
+        datasets = [stage_datasets[stage] for stage in set(stages)]
+        values = [getattr(dataset, attr) for dataset in datasets if dataset is not None]
+        return max((value for value in values if value is not None), default=0)
 
 
 @dataclass
@@ -671,6 +982,7 @@ class DatasetProcessingParams:
         splits_path: Optional[Union[str, os.PathLike]] = None,
         split_names: Optional[List[str]] = ["train", "val", "test"],
         label_normalization: Optional[Union[Dict[str, Any], omegaconf.DictConfig]] = None,
+        stratify: bool = False,
     ):
         """
         object to store the parameters for the dataset processing
@@ -689,6 +1001,7 @@ class DatasetProcessingParams:
             split_test: The fraction of the data to use for testing
             seed: The seed to use for the splits and subsampling
             splits_path: The path to the splits
+            stratify: Whether to keep the proportion of each class of binary labels in the random splits
         """
 
         if df is None and df_path is None:
@@ -713,6 +1026,7 @@ class DatasetProcessingParams:
         self.split_names = split_names
         self.label_normalization = label_normalization
         self.epoch_sampling_fraction = epoch_sampling_fraction
+        self.stratify = stratify
 
 
 class IPUDataModuleModifier:
@@ -784,7 +1098,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         batch_size_per_pack: Optional[int] = None,
         num_workers: int = 0,
         pin_memory: bool = True,
-        persistent_workers: bool = False,
+        persistent_workers: Optional[bool] = None,
         multiprocessing_context: Optional[str] = None,
         featurization_n_jobs: int = -1,
         featurization_progress: bool = False,
@@ -792,6 +1106,10 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         featurization_batch_size: int = 1000,
         collate_fn: Optional[Callable] = None,
         prepare_dict_or_graph: str = "pyg:graph",
+        prefetch_factor: Optional[int] = 2,
+        pin_memory_device: str = "",
+        sharing_strategy: Optional[str] = "file_system",
+        csv_engine: Optional[str] = None,
         **kwargs,
     ):
         """
@@ -851,7 +1169,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             batch_size_training: batch size for training and val dataset.
             batch_size_inference: batch size for test dataset.
             num_workers: Number of workers for the dataloader. Use -1 to use all available
-                cores.
+                cores, up to `MAX_AUTO_NUM_WORKERS`.
             pin_memory: Whether to pin on paginated CPU memory for the dataloader.
             featurization_n_jobs: Number of cores to use for the featurization.
             featurization_progress: whether to show a progress bar during featurization.
@@ -871,6 +1189,14 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
                   pyg `Data` will be created during data-loading, but faster with large
                   `num_workers`, and less likely to cause memory issues with the parallelization.
                 - "pyg:graph": Process molecules as `pyg.data.Data`.
+            prefetch_factor: Number of batches loaded in advance by each worker of the dataloader.
+                Higher values can run out of memory with large batches. Ignored when `num_workers=0`.
+            pin_memory_device: Device on which to pin the memory when `pin_memory=True`, e.g. `"cuda:1"`.
+                If empty, the pytorch default is used.
+            sharing_strategy: Strategy of `torch.multiprocessing` to share tensors between the data workers.
+                If `None`, the strategy is left unchanged.
+            csv_engine: Parser of `pd.read_csv` for the csv and tsv data files, e.g. `"pyarrow"`.
+                If `None`, the default pandas parser is used.
         """
         BaseDataModule.__init__(
             self,
@@ -882,6 +1208,10 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             persistent_workers=persistent_workers,
             multiprocessing_context=multiprocessing_context,
             collate_fn=collate_fn,
+            prefetch_factor=prefetch_factor,
+            pin_memory_device=pin_memory_device,
+            sharing_strategy=sharing_strategy,
+            csv_engine=csv_engine,
         )
         IPUDataModuleModifier.__init__(self, **kwargs)
 
@@ -1011,8 +1341,12 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             self.get_label_statistics(self.processed_graph_data_path, self.data_hash, dataset=None)
             return
 
+        # List the files again, in case they changed since a previous preparation
+        self._invalidate_glob_cache()
+
         """Load all single-task dataframes."""
         task_df = {}
+        sampled_tasks = set()
         for task, args in self.task_dataset_processing_params.items():
             if args.label_normalization is None:
                 args.label_normalization = {}
@@ -1030,7 +1364,13 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
                     + check_arg_iterator(args.weights_col, enforce_type=list)
                 )
                 label_dtype = {col: np.float32 for col in label_cols}
-                task_df[task] = self._read_table(args.df_path, usecols=usecols, dtype=label_dtype)
+                # An integer sub-sampling is done while reading, to skip the rows that are not sampled
+                sample_size = args.sample_size if isinstance(args.sample_size, int) else None
+                task_df[task] = self._read_table(
+                    args.df_path, sample_size=sample_size, seed=args.seed, usecols=usecols, dtype=label_dtype
+                )
+                if sample_size is not None:
+                    sampled_tasks.add(task)
 
             else:
                 label_cols = self._parse_label_cols(
@@ -1044,13 +1384,11 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
 
         """Subsample the data frames and extract the necessary data to create SingleTaskDatasets for each task (smiles, labels, extras)."""
         task_dataset_args = {}
-        for task in task_df.keys():
-            task_dataset_args[task] = {}
-
         for task, df in task_df.items():
-            # Subsample all the dataframes
-            sample_size = self.task_dataset_processing_params[task].sample_size
-            df = self._sub_sample_df(df, sample_size, self.task_dataset_processing_params[task].seed)
+            # Subsample all the dataframes that were not already sub-sampled while reading
+            if task not in sampled_tasks:
+                sample_size = self.task_dataset_processing_params[task].sample_size
+                df = self._sub_sample_df(df, sample_size, self.task_dataset_processing_params[task].seed)
 
             logger.info(f"Prepare single-task dataset for task '{task}' with {len(df)} data points.")
 
@@ -1070,14 +1408,15 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             )
 
             # Store the relevant information for each task's dataset
-            task_dataset_args[task]["smiles"] = smiles
-            task_dataset_args[task]["labels"] = labels
-            task_dataset_args[task]["sample_idx"] = sample_idx
-            task_dataset_args[task]["extras"] = extras
+            task_dataset_args[task] = {
+                "smiles": smiles,
+                "labels": labels,
+                "sample_idx": sample_idx,
+                "extras": extras,
+            }
 
         """Convert SMILES to features (graphs, fingerprints, etc.) for the unique molecules found."""
         all_smiles = []
-        all_tasks = []
         idx_per_task = {}
         total_len = 0
         for task, dataset_args in task_dataset_args.items():
@@ -1085,8 +1424,6 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             num_smiles = len(dataset_args["smiles"])
             idx_per_task[task] = (total_len, total_len + num_smiles)
             total_len += num_smiles
-            for count in range(len(dataset_args["smiles"])):
-                all_tasks.append(task)
         # Get all unique mol ids
         all_unique_mol_ids = smiles_to_unique_mol_ids(
             all_smiles,
@@ -1094,52 +1431,55 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             featurization_batch_size=self.featurization_batch_size,
             backend=self.featurization_backend,
         )
-        _, unique_ids_idx, unique_ids_inv = np.unique(
-            all_unique_mol_ids, return_index=True, return_inverse=True
-        )
+        # An object array keeps the `None` ids and makes the per-task slices views instead of copies
+        all_unique_mol_ids = np.asarray(all_unique_mol_ids, dtype=object)
+        unique_ids_idx, unique_ids_inv = self._get_unique_indices(all_unique_mol_ids)
 
-        smiles_to_featurize = [all_smiles[ii] for ii in unique_ids_idx]
+        # Index with python ints, rather than numpy scalars
+        smiles_to_featurize = [all_smiles[ii] for ii in unique_ids_idx.tolist()]
 
         # Convert SMILES to features
-        features, _ = self._featurize_molecules(smiles_to_featurize)
-
-        # Store the features (including Nones, which will be filtered in the next step)
-        for task in task_dataset_args.keys():
-            task_dataset_args[task]["features"] = []
+        features, idx_none = self._featurize_molecules(smiles_to_featurize)
+        failed_featurization = np.zeros(len(features), dtype=bool)
+        failed_featurization[idx_none] = True
+
+        # Store the features matching up with the original smiles of each task
+        # (including Nones, which will be filtered in the next step)
+        for task, (start, end) in idx_per_task.items():
+            task_dataset_args[task]["features"] = [features[ii] for ii in unique_ids_inv[start:end].tolist()]
             task_dataset_args[task]["idx_none"] = []
-        # Create a list of features matching up with the original smiles
-        all_features = [features[unique_idx] for unique_idx in unique_ids_inv]
-
-        # Add the features to the task-specific data
-        for all_idx, task in enumerate(all_tasks):
-            task_dataset_args[task]["features"].append(all_features[all_idx])
 
         """Filter data based on molecules which failed featurization. Create single task datasets as well."""
         self.single_task_datasets = {}
         for task, args in task_dataset_args.items():
             # Find out which molecule failed featurization, and filter them out
-            idx_none = []
-            for idx, (feat, labels, smiles) in enumerate(
-                zip(args["features"], args["labels"], args["smiles"])
-            ):
-                if did_featurization_fail(feat) or found_size_mismatch(task, feat, labels, smiles):
-                    idx_none.append(idx)
-            this_unique_ids = all_unique_mol_ids[idx_per_task[task][0] : idx_per_task[task][1]]
-            df, features, smiles, labels, sample_idx, extras, this_unique_ids = self._filter_none_molecules(
-                idx_none,
-                task_df[task],
-                args["features"],
-                args["smiles"],
-                args["labels"],
-                args["sample_idx"],
-                args["extras"],
-                this_unique_ids,
-            )
-            task_dataset_args[task]["smiles"] = smiles
-            task_dataset_args[task]["labels"] = labels
-            task_dataset_args[task]["features"] = features
-            task_dataset_args[task]["sample_idx"] = sample_idx
-            task_dataset_args[task]["extras"] = extras
+            start, end = idx_per_task[task]
+            failed = failed_featurization[unique_ids_inv[start:end]]
+            # Graph labels cannot mismatch the size of the graph
+            if not task.startswith("graph_"):
+                for idx, (feat, labels, smiles) in enumerate(
+                    zip(args["features"], args["labels"], args["smiles"])
+                ):
+                    if (not failed[idx]) and found_size_mismatch(task, feat, labels, smiles):
+                        failed[idx] = True
+            idx_none = np.flatnonzero(failed).tolist()
+            this_unique_ids = all_unique_mol_ids[start:end]
+            # The dataframe is not filtered, since the splits are computed on all its rows
+            if len(idx_none) > 0:
+                features, smiles, labels, sample_idx, extras, this_unique_ids = self._filter_none_molecules(
+                    idx_none,
+                    args["features"],
+                    args["smiles"],
+                    args["labels"],
+                    args["sample_idx"],
+                    args["extras"],
+                    this_unique_ids,
+                )
+                task_dataset_args[task]["smiles"] = smiles
+                task_dataset_args[task]["labels"] = labels
+                task_dataset_args[task]["features"] = features
+                task_dataset_args[task]["sample_idx"] = sample_idx
+                task_dataset_args[task]["extras"] = extras
 
             # We have the necessary components to create single-task datasets.
             self.single_task_datasets[task] = Datasets.SingleTaskDataset(
@@ -1165,6 +1505,9 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
                 splits_path=self.task_dataset_processing_params[task].splits_path,
                 split_names=self.task_dataset_processing_params[task].split_names,
                 sample_idx=task_dataset_args[task]["sample_idx"],
+                stratify=self._get_stratify_labels(
+                    task_dataset_args[task]["labels"], self.task_dataset_processing_params[task].stratify
+                ),
             )
             self.task_train_indices[task] = train_indices
             self.task_val_indices[task] = val_indices
@@ -1285,14 +1628,23 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             data_is_cached=self._data_is_cached,
         )  # type: ignore
 
+        # Gather the labels once for both the statistics and the normalization.
+        # Normalization has already been applied in cached data
+        all_labels = None
+        if not self._data_is_prepared:
+            all_labels = self._get_all_labels(multitask_dataset)
+
         # calculate statistics for the train split and used for all splits normalization
         if stage == "train":
             self.get_label_statistics(
-                self.processed_graph_data_path, self.data_hash, multitask_dataset, train=True
+                self.processed_graph_data_path,
+                self.data_hash,
+                multitask_dataset,
+                train=True,
+                all_labels=all_labels,
             )
-        # Normalization has already been applied in cached data
         if not self._data_is_prepared:
-            self.normalize_label(multitask_dataset, stage)
+            self.normalize_label(multitask_dataset, stage, all_labels=all_labels)
 
         return multitask_dataset
 
@@ -1345,32 +1697,40 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
 
     def get_folder_size(self, path):
         # check if the data items are actually saved into the folders
-        return sum(os.path.getsize(osp.join(path, f)) for f in os.listdir(path))
+        # `DirEntry.stat` reuses the information of the directory listing when possible
+        with os.scandir(path) as entries:
+            return sum(entry.stat().st_size for entry in entries)
 
-    def calculate_statistics(self, dataset: Datasets.MultitaskDataset, train: bool = False):
+    def calculate_statistics(
+        self,
+        dataset: Datasets.MultitaskDataset,
+        train: bool = False,
+        all_labels: Optional[List[Dict[str, Any]]] = None,
+    ):
         """
         Calculate the statistics of the labels for each task, and overwrites the `self.task_norms` attribute.
 
         Parameters:
             dataset: the dataset to calculate the statistics from
             train: whether the dataset is the training set
+            all_labels: the labels of each molecule of the dataset, from `_get_all_labels`.
+                If None, they are gathered from the dataset.
 
         """
 
         if self.task_norms and train:
+            # Gather the labels of all the molecules once, rather than iterating the dataset for each task
+            if all_labels is None:
+                all_labels = self._get_all_labels(dataset)
             for task in dataset.labels_size.keys():
+                task_labels = [labels[task] for labels in all_labels if task in labels]
                 # if the label type is graph_*, we need to stack them as the tensor shape is (num_labels, )
                 if task.startswith("graph"):
-                    labels = np.stack(
-                        np.array([datum["labels"][task] for datum in dataset if task in datum["labels"]]),
-                        axis=0,
-                    )
+                    labels = np.stack(task_labels, axis=0)
                 # for other tasks with node_ and edge_, the label shape is [num_nodes/num_edges, num_labels]
                 # we can concatenate them directly
                 else:
-                    labels = np.concatenate(
-                        [datum["labels"][task] for datum in dataset if task in datum["labels"]], axis=0
-                    )
+                    labels = np.concatenate(task_labels, axis=0)
 
                 self.task_norms[task].calculate_statistics(labels)
 
@@ -1380,6 +1740,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         data_hash: str,
         dataset: Datasets.MultitaskDataset,
         train: bool = False,
+        all_labels: Optional[List[Dict[str, Any]]] = None,
     ):
         """
         Get the label statistics from the dataset, and save them to file, if needed.
@@ -1390,27 +1751,36 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             data_hash: the hash of the dataset generated by `get_data_hash()`
             dataset: the dataset to calculate the statistics from
             train: whether the dataset is the training set
+            all_labels: the labels of each molecule of the dataset, from `_get_all_labels`.
+                If None, they are gathered from the dataset when needed.
 
         """
         if data_path is None:
-            self.calculate_statistics(dataset, train=train)
+            self.calculate_statistics(dataset, train=train, all_labels=all_labels)
         else:
             path_with_hash = os.path.join(data_path, data_hash)
             os.makedirs(path_with_hash, exist_ok=True)
             filename = os.path.join(path_with_hash, "task_norms.pkl")
             if self.task_norms and train and not os.path.isfile(filename):
-                self.calculate_statistics(dataset, train=train)
+                self.calculate_statistics(dataset, train=train, all_labels=all_labels)
                 torch.save(self.task_norms, filename, pickle_protocol=4)
             # if any of the above three condition does not satisfy, we load from file.
             else:
                 self.task_norms = torch.load(filename)
 
-    def normalize_label(self, dataset: Datasets.MultitaskDataset, stage) -> Datasets.MultitaskDataset:
+    def normalize_label(
+        self,
+        dataset: Datasets.MultitaskDataset,
+        stage,
+        all_labels: Optional[List[Dict[str, Any]]] = None,
+    ) -> Datasets.MultitaskDataset:
         """
         Normalize the labels in the dataset using the statistics in `self.task_norms`.
 
         Parameters:
             dataset: the dataset to normalize the labels from
+            all_labels: the labels of each molecule of the dataset, from `_get_all_labels`,
+                which are normalized in-place. If None, they are gathered from the dataset when needed.
 
         Returns:
             the dataset with normalized labels
@@ -1418,34 +1788,97 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         for task in dataset.labels_size.keys():
             # we normalize the dataset if (it is train split) or (it is val/test splits and normalize_val_test is set to true)
             if (stage == "train") or (stage in ["val", "test"] and self.task_norms[task].normalize_val_test):
-                for i in range(len(dataset)):
-                    if task in dataset[i]["labels"]:
-                        dataset[i]["labels"][task] = self.task_norms[task].normalize(
-                            dataset[i]["labels"][task]
-                        )
+                if all_labels is None:
+                    all_labels = self._get_all_labels(dataset)
+                task_labels = [labels for labels in all_labels if task in labels]
+                normalized = self._normalize_task_labels(
+                    [labels[task] for labels in task_labels], self.task_norms[task]
+                )
+                for labels, value in zip(task_labels, normalized):
+                    labels[task] = value
         return dataset
 
+    @staticmethod
+    def _get_all_labels(dataset: Datasets.MultitaskDataset) -> List[Dict[str, Any]]:
+        """
+        Gather the labels of each molecule of the dataset, in a single pass over the dataset.
+        """
+        return [dataset[i]["labels"] for i in range(len(dataset))]
+
+    @staticmethod
+    def _get_unique_indices(ids: Iterable[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the unique ids in a single hashing pass, instead of sorting them like `np.unique`.
+
+        Parameters:
+            ids: the ids, which must be hashable
+
+        Returns:
+            unique_idx: the index of the first occurrence of each unique id, in order of appearance
+            inverse: for each id, the position of its unique id in `unique_idx`
+        """
+        seen = {}
+        unique_idx = []
+        inverse = []
+        for ii, id_ in enumerate(ids):
+            jj = seen.get(id_)
+            if jj is None:
+                jj = seen[id_] = len(unique_idx)
+                unique_idx.append(ii)
+            inverse.append(jj)
+        return np.asarray(unique_idx, dtype=np.int64), np.asarray(inverse, dtype=np.int64)
+
+    @staticmethod
+    def _normalize_task_labels(values: List[Any], task_norm: LabelNormalization) -> List[Any]:
+        """
+        Normalize the labels of a task for all the molecules with a single call to `task_norm.normalize`,
+        and split them back per molecule.
+
+        Parameters:
+            values: the labels of each molecule for the task
+            task_norm: the normalization of the task
+
+        Returns:
+            the normalized labels of each molecule
+        """
+        if len(values) == 0:
+            return values
+
+        first = values[0]
+        if isinstance(first, np.ndarray) and all(isinstance(value, np.ndarray) for value in values):
+            if (first.ndim == 1) and all(value.shape == first.shape for value in values):
+                # One vector of labels per molecule, e.g. graph labels
+                return list(task_norm.normalize(np.stack(values, axis=0)))
+
+            if (first.ndim > 1) and all(value.shape[1:] == first.shape[1:] for value in values):
+                # One row of labels per node or edge
+                normalized = task_norm.normalize(np.concatenate(values, axis=0))
+                return np.split(normalized, np.cumsum([len(value) for value in values])[:-1], axis=0)
+
+        # Labels that cannot be batched are normalized one by one
+        return [task_norm.normalize(value) for value in values]
+
     def save_featurized_data(self, dataset: Datasets.MultitaskDataset, processed_data_path):
         os.makedirs(processed_data_path)  # In case the len(dataset) is 0
-        for i in range(0, len(dataset), 1000):
-            os.makedirs(os.path.join(processed_data_path, format(i // 1000, "04d")), exist_ok=True)
-        process_params = [(index, datum, processed_data_path) for index, datum in enumerate(dataset)]
+
+        # Group the data in shards of 1000, each saved to a single file,
+        # to avoid creating, and later opening, one small file per molecule
+        num_shards = (len(dataset) + 999) // 1000
 
         # Check if "about" is in the Dataset object
         about = ""
         if hasattr(dataset, "about"):
             about = dataset.about
-        for param in tqdm(process_params, desc=f"Saving featurized data {about}"):
-            self.process_func(param)
-        return
 
-    def process_func(self, param):
-        index, datum, folder = param
-        filename = os.path.join(folder, format(index // 1000, "04d"), format(index, "07d") + ".pkl")
-        torch.save(
-            {"graph_with_features": datum["features"], "labels": datum["labels"]},
-            filename,
-            pickle_protocol=4,
+        # Save the shards in parallel threads, which share the dataset instead of pickling
+        # the data of each shard to a worker process, only to serialize it again
+        dm.parallelized(
+            partial(_save_featurized_shard, dataset=dataset, folder=processed_data_path),
+            range(num_shards),
+            progress=True,
+            n_jobs=self.featurization_n_jobs,
+            backend="threading",
+            tqdm_kwargs={"desc": f"Saving featurized data {about}"},
         )
         return
 
@@ -1521,13 +1954,11 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
     def get_collate_fn(self, collate_fn):
         if collate_fn is None:
             # Some values become `inf` when changing data type. `mask_nan` deals with that
-            collate_fn = partial(
-                graphium_collate_fn,
+            collate_fn = _GraphiumCollate(
                 mask_nan=0,
                 do_not_collate_keys=["smiles", "mol_ids"],
                 batch_size_per_pack=self.batch_size_per_pack,
             )
-            collate_fn.__name__ = graphium_collate_fn.__name__
         return collate_fn
 
     # Cannot be used as is for the multitask version, because sample_idx does not apply.
@@ -1571,7 +2002,8 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         )
 
         # Warn about None molecules
-        idx_none = [ii for ii, feat in enumerate(features) if did_featurization_fail(feat)]
+        failed = np.fromiter(map(did_featurization_fail, features), dtype=bool, count=len(features))
+        idx_none = np.flatnonzero(failed).tolist()
         if len(idx_none) > 0:
             mols_to_msg = [
                 f"idx={idx} - smiles={smiles[idx]} - Error_msg[:-200]=\n{str(features[idx])[:-200]}"
@@ -1605,31 +2037,32 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         """
         if len(idx_none) == 0:
             return args
-        idx_none = np.asarray(idx_none)
-
-        out = []
-        for arg in args:
-            if isinstance(arg, pd.DataFrame):
-                new = arg.drop(arg.index[idx_none], axis=0)
-            elif isinstance(arg, pd.Series):
-                new = arg.drop(arg.index[idx_none], axis=0)
+        idx_none = np.asarray(idx_none, dtype=np.int64)
+
+        # Boolean masks of the rows to keep, built once per length and shared by all the arguments
+        keep_masks = {}
+
+        def get_keep_mask(length: int) -> np.ndarray:
+            if length not in keep_masks:
+                keep = np.ones(length, dtype=bool)
+                keep[idx_none] = False
+                keep_masks[length] = keep
+            return keep_masks[length]
+
+        def filter_arg(arg):
+            if isinstance(arg, (pd.DataFrame, pd.Series)):
+                return arg.iloc[get_keep_mask(len(arg))]
             elif isinstance(arg, np.ndarray):
-                new = np.delete(arg, idx_none, axis=0)
+                return arg[get_keep_mask(arg.shape[0])]
             elif isinstance(arg, torch.Tensor):
-                not_none = torch.ones(arg.shape[0], dtype=bool)
-                not_none[idx_none] = False
-                new = arg[not_none]
+                return arg[torch.from_numpy(get_keep_mask(arg.shape[0]))]
             elif isinstance(arg, (list, tuple)):
-                arg = list(arg)
-                new = [elem for ii, elem in enumerate(arg) if ii not in idx_none]
+                return list(compress(arg, get_keep_mask(len(arg)).tolist()))
             elif isinstance(arg, dict):
-                new = {}
-                for key, val in arg.items():
-                    new[key] = MultitaskFromSmilesDataModule._filter_none_molecules(idx_none, val)  # Careful
-            else:
-                new = arg
-            out.append(new)
+                return {key: filter_arg(val) for key, val in arg.items()}  # Careful
+            return arg
 
+        out = [filter_arg(arg) for arg in args]
         out = tuple(out) if len(out) > 1 else out[0]
 
         return out
@@ -1685,19 +2118,19 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
 
     @property
     def is_prepared(self):
-        if not hasattr(self, "dataset"):
-            return False
-        return getattr(self, "dataset") is not None
+        return self.__dict__.get("dataset") is not None
 
     @property
     def is_setup(self):
-        if not (hasattr(self, "train_ds") or hasattr(self, "test_ds")):
-            return False
-        return (getattr(self, "train_ds") is not None) or (getattr(self, "test_ds") is not None)
+        attrs = self.__dict__
+        return (attrs.get("train_ds") is not None) or (attrs.get("test_ds") is not None)
 
     @property
     def num_node_feats(self):
         """Return the number of node features in the first graph"""
+        feat_dims = self._infer_feat_dims()
+        if (feat_dims is not None) and (feat_dims["feat"] > 0):
+            return feat_dims["feat"]
         graph = self.get_fake_graph()
         num_feats = graph.feat.shape[1]
         return num_feats
@@ -1728,26 +2161,52 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
     def num_edge_feats(self):
         """Return the number of edge features in the first graph"""
 
+        feat_dims = self._infer_feat_dims()
+        if feat_dims is not None:
+            return feat_dims["edge_feat"]
+
         graph = self.get_fake_graph()
         empty = torch.Tensor([])
         num_feats = graph.get("edge_feat", empty).shape[-1]
 
         return num_feats
 
+    def _infer_feat_dims(self) -> Optional[Dict[str, int]]:
+        """
+        Get the number of node and edge features from the featurization arguments,
+        without featurizing a fake graph.
+
+        Returns:
+            The number of features under the keys `"feat"` and `"edge_feat"`,
+            or `None` if they cannot be inferred from the featurization arguments
+        """
+        try:
+            return get_mol_feature_dims(**self.smiles_transformer.keywords)
+        except (ValueError, TypeError, AttributeError):
+            return None
+
     def get_fake_graph(self):
         """
         Low memory footprint method to get the featurization of a fake graph
         without reading the dataset. Useful for getting the number of node/edge features.
 
+        The graph is computed once per `smiles_transformer`, and shared between the calls,
+        so it should not be modified.
+
         Returns:
             graph: A fake graph with the right featurization
         """
 
+        trans = self.smiles_transformer
+        cached = getattr(self, "_fake_graph_cache", None)
+        if (cached is not None) and (cached[0] is trans):
+            return cached[1]
+
         smiles = "C1=CC=CC=C1"
-        trans = deepcopy(self.smiles_transformer)
-        trans.keywords.setdefault("on_error", "raise")
-        trans.keywords.setdefault("mask_nan", 0.0)
-        graph = trans(smiles)
+        # Bind the default options to a new partial, without copying the featurization arguments
+        keywords = {"on_error": "raise", "mask_nan": 0.0, **trans.keywords}
+        graph = partial(trans.func, *trans.args, **keywords)(smiles)
+        self._fake_graph_cache = (trans, graph)
         return graph
 
     ########################## Private methods ######################################
@@ -1757,6 +2216,29 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
     def _load_from_cache(self):
         raise NotImplementedError()
 
+    @staticmethod
+    def _get_smiles_col(df: pd.DataFrame, smiles_col: Optional[str] = None) -> str:
+        """
+        Get the name of the SMILES column of a dataframe.
+        Parameters:
+            df: The dataframe containing the SMILES
+            smiles_col: Name of the column containing the SMILES. If `None`, it is the only
+                column containing "smile" in its name
+        Returns:
+            smiles_col: Name of the column containing the SMILES
+        """
+        if smiles_col is None:  # Should we specify which dataset has caused the potential issue?
+            smiles_col_all = [col for col in df.columns if "smile" in str(col).lower()]
+            if len(smiles_col_all) == 0:
+                raise ValueError(f"No SMILES column found in dataframe. Columns are {df.columns}")
+            elif len(smiles_col_all) > 1:
+                raise ValueError(
+                    f"Multiple SMILES column found in dataframe. SMILES Columns are {smiles_col_all}"
+                )
+
+            smiles_col = smiles_col_all[0]
+        return smiles_col
+
     def _extract_smiles_labels(
         self,
         df: pd.DataFrame,
@@ -1786,16 +2268,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             smiles, labels, sample_idx, extras
         """
 
-        if smiles_col is None:  # Should we specify which dataset has caused the potential issue?
-            smiles_col_all = [col for col in df.columns if "smile" in str(col).lower()]
-            if len(smiles_col_all) == 0:
-                raise ValueError(f"No SMILES column found in dataframe. Columns are {df.columns}")
-            elif len(smiles_col_all) > 1:
-                raise ValueError(
-                    f"Multiple SMILES column found in dataframe. SMILES Columns are {smiles_col_all}"
-                )
-
-            smiles_col = smiles_col_all[0]
+        smiles_col = self._get_smiles_col(df, smiles_col)
 
         if label_cols is None:
             label_cols = df.columns.drop(smiles_col)
@@ -1834,22 +2307,17 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             if not np.all((labels == 0) | (labels == 1)):
                 raise ValueError("Labels must be binary for `weights_type`")
 
-            if weights_type == "sample_label_balanced":
-                ratio_pos_neg = np.sum(labels, axis=0, keepdims=1) / labels.shape[0]
-                weights = np.zeros(labels.shape)
-                weights[labels == 0] = ratio_pos_neg
-                weights[labels == 1] = ratio_pos_neg**-1
-
-            elif weights_type == "sample_balanced":
-                ratio_pos_neg = np.sum(labels, axis=0, keepdims=1) / labels.shape[0]
-                weights = np.zeros(labels.shape)
-                weights[labels == 0] = ratio_pos_neg
-                weights[labels == 1] = ratio_pos_neg**-1
-                weights = np.prod(weights, axis=1)
-
-            else:
+            if weights_type not in ["sample_label_balanced", "sample_balanced"]:
                 raise ValueError(f"Undefined `weights_type` {weights_type}")
 
+            # Weight the negative labels by the ratio of positives of their label column,
+            # and the positive labels by the inverse of that ratio
+            ratio_pos_neg = np.sum(labels, axis=0, keepdims=True) / labels.shape[0]
+            weights = np.where(labels == 1, ratio_pos_neg**-1, ratio_pos_neg)
+
+            if weights_type == "sample_balanced":
+                weights = np.prod(weights, axis=1)
+
             weights /= np.max(weights)  # Put the max weight to 1
 
         extras = {"weights": weights, "mol_ids": mol_ids}
@@ -1862,8 +2330,9 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         split_test: float,
         sample_idx: Optional[Iterable[int]] = None,
         split_seed: int = None,
-        splits_path: Union[str, os.PathLike] = None,
+        splits_path: Union[str, os.PathLike, Dict[str, Iterable[int]]] = None,
         split_names: Optional[List[str]] = ["train", "val", "test"],
+        stratify: Optional[np.ndarray] = None,
     ):
         r"""
         Compute indices of random splits.
@@ -1873,7 +2342,10 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             split_test: Fraction of the dataset to use for testing
             sample_idx: Indices of the samples to use for splitting
             split_seed: Seed for the random splitting
-            splits_path: Path to a file containing the splits
+            splits_path: Path to a file containing the splits, or a dictionary of the split indices
+            split_names: Names of the train, val and test columns of the splits file
+            stratify: Class labels of the samples in `sample_idx`, used to keep the proportion of
+                each class in the random splits. A 2D array is stratified on the combination of its columns.
         Returns:
             train_indices, val_indices, test_indices
         """
@@ -1881,13 +2353,44 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         if sample_idx is None:
             sample_idx = np.arange(dataset_size)
 
-        if splits_path is None:
+        if (splits_path is None) and (stratify is not None):
+            # Stratified random splitting, done on the positions of the samples
+            sample_idx = np.asarray(sample_idx)
+            stratify = np.asarray(stratify)
+            if stratify.ndim > 1:
+                # Composite key, with one class per unique combination of the label columns
+                _, stratify = np.unique(stratify.reshape(len(stratify), -1), axis=0, return_inverse=True)
+            _, stratify = np.unique(stratify, return_inverse=True)
+            stratify = stratify.reshape(-1)
+
+            positions = np.arange(len(sample_idx))
+            if split_test + split_val > 0:
+                train_pos, val_test_pos = self._stratified_train_test_split(
+                    positions, stratify, test_size=split_val + split_test, seed=split_seed
+                )
+                sub_split_test = split_test / (split_test + split_val)
+            else:
+                train_pos, val_test_pos = positions, positions[:0]
+                sub_split_test = 0
+
+            if split_test > 0:
+                val_pos, test_pos = self._stratified_train_test_split(
+                    val_test_pos, stratify[val_test_pos], test_size=sub_split_test, seed=split_seed
+                )
+            else:
+                val_pos, test_pos = val_test_pos, positions[:0]
+
+            train_indices = sample_idx[train_pos]
+            val_indices = sample_idx[val_pos]
+            test_indices = sample_idx[test_pos]
+
+        elif splits_path is None:
             # Random splitting
             if split_test + split_val > 0:
-                train_indices, val_test_indices = train_test_split(
+                train_indices, val_test_indices = self._train_test_split(
                     sample_idx,
                     test_size=split_val + split_test,
-                    random_state=split_seed,
+                    seed=split_seed,
                 )
                 sub_split_test = split_test / (split_test + split_val)
             else:
@@ -1896,15 +2399,22 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
                 sub_split_test = 0
 
             if split_test > 0:
-                val_indices, test_indices = train_test_split(
+                val_indices, test_indices = self._train_test_split(
                     val_test_indices,
                     test_size=sub_split_test,
-                    random_state=split_seed,
+                    seed=split_seed,
                 )
             else:
                 val_indices = val_test_indices
                 test_indices = np.array([])
 
+        elif isinstance(splits_path, dict):
+            # Split from indices already in memory
+            train, val, test = split_names
+            train_indices = self._drop_nan_indices(splits_path[train])
+            val_indices = self._drop_nan_indices(splits_path[val])
+            test_indices = self._drop_nan_indices(splits_path[test])
+
         else:
             # Split from an indices file
             file_type = self._get_data_file_type(splits_path)
@@ -1921,23 +2431,140 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
                     f"file type `{file_type}` for `{splits_path}` not recognised, please use .pt, .csv or .tsv"
                 )
             train, val, test = split_names
-            train_indices = np.asarray(splits[train]).astype("int")
-            train_indices = train_indices[~np.isnan(train_indices)].tolist()
-            val_indices = np.asarray(splits[val]).astype("int")
-            val_indices = val_indices[~np.isnan(val_indices)].tolist()
-            test_indices = np.asarray(splits[test]).astype("int")
-            test_indices = test_indices[~np.isnan(test_indices)].tolist()
-
-        # Filter train, val and test indices
-        _, train_idx, _ = np.intersect1d(sample_idx, train_indices, return_indices=True)
-        train_indices = train_idx.tolist()
-        _, valid_idx, _ = np.intersect1d(sample_idx, val_indices, return_indices=True)
-        val_indices = valid_idx.tolist()
-        _, test_idx, _ = np.intersect1d(sample_idx, test_indices, return_indices=True)
-        test_indices = test_idx.tolist()
+            train_indices = self._drop_nan_indices(splits[train])
+            val_indices = self._drop_nan_indices(splits[val])
+            test_indices = self._drop_nan_indices(splits[test])
+
+        # Filter train, val and test indices, and convert them to positions in `sample_idx`,
+        # ordered by index. The hashed lookup avoids sorting `sample_idx` for each split.
+        sample_idx = np.asarray(sample_idx)
+        if np.array_equal(sample_idx, np.arange(len(sample_idx))):
+            # The positions of a full range are the indices themselves, found without any hashing
+            sample_pos = pd.RangeIndex(len(sample_idx))
+        else:
+            sample_pos = pd.Index(sample_idx)
+        train_indices = self._get_positions(sample_pos, train_indices)
+        val_indices = self._get_positions(sample_pos, val_indices)
+        test_indices = self._get_positions(sample_pos, test_indices)
 
         return train_indices, val_indices, test_indices
 
+    @staticmethod
+    def _get_stratify_labels(labels: Any, stratify: bool) -> Optional[np.ndarray]:
+        r"""
+        Get the classes to stratify the random splits on, with one class per combination of the label columns.
+        Parameters:
+            labels: The labels of the task, which must be binary. Missing labels (NaN) are one more class.
+            stratify: Whether to stratify the splits. If `False`, `None` is returned.
+        Returns:
+            The class of each label, as an int8 array of 0, 1 or 2 for missing labels, or `None`
+        """
+        if (not stratify) or (not isinstance(labels, np.ndarray)) or (labels.size == 0):
+            return None
+        if labels.dtype.kind not in "biuf":
+            raise ValueError(f"Only numerical labels can be stratified, got dtype `{labels.dtype}`")
+
+        is_nan = np.isnan(labels) if labels.dtype.kind == "f" else np.zeros(labels.shape, dtype=bool)
+        if not np.isin(labels[~is_nan], [0, 1]).all():
+            raise ValueError("Only binary labels, with values 0 and 1 or NaN, can be stratified")
+        return np.where(is_nan, 2, labels).astype(np.int8)
+
+    @staticmethod
+    def _drop_nan_indices(indices: Iterable) -> np.ndarray:
+        r"""
+        Convert the indices of a split to an integer array, without the NaNs padding
+        the shorter splits of a csv file.
+        """
+        indices = np.asarray(indices)
+        if indices.dtype.kind == "f":
+            indices = indices[~np.isnan(indices)]
+        return indices.astype(np.int64)
+
+    @staticmethod
+    def _get_positions(sample_pos: pd.Index, indices: Iterable[int]) -> np.ndarray:
+        r"""
+        Get the positions in `sample_pos` of the unique `indices` found in it, sorted by index,
+        like the positions returned by `np.intersect1d(sample_idx, indices, return_indices=True)`.
+        Parameters:
+            sample_pos: The indices of the samples, as a `pd.Index`
+            indices: The indices to look for
+        Returns:
+            The positions of the indices found in `sample_pos`, as an int64 array.
+            For duplicated indices in `sample_pos`, the position of the first occurrence is used.
+        """
+        first_pos = None
+        if not sample_pos.is_unique:
+            # `get_indexer` requires unique values, so only the first occurrences are looked up
+            is_first = ~sample_pos.duplicated(keep="first")
+            first_pos = np.flatnonzero(is_first)
+            sample_pos = sample_pos[is_first]
+        positions = sample_pos.get_indexer(np.unique(np.asarray(indices)))
+        positions = positions[positions >= 0].astype(np.int64, copy=False)
+        if first_pos is not None:
+            positions = first_pos[positions]
+        return positions
+
+    @staticmethod
+    def _train_test_split(
+        indices: Iterable[int], test_size: float, seed: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        r"""
+        Randomly split indices in two. The splits are the same as the ones of
+        `sklearn.model_selection.train_test_split` for the same seed, without importing sklearn.
+        Parameters:
+            indices: The indices to split
+            test_size: Fraction of the indices to put in the second split
+            seed: Seed for the random splitting
+        Returns:
+            train_indices, test_indices
+        """
+        indices = np.asarray(indices)
+        n_test = int(np.ceil(test_size * len(indices)))
+        random_state = np.random if seed is None else np.random.RandomState(seed)
+        permutation = random_state.permutation(len(indices))
+        return indices[permutation[n_test:]], indices[permutation[:n_test]]
+
+    @staticmethod
+    def _stratified_train_test_split(
+        indices: Iterable[int], stratify: np.ndarray, test_size: float, seed: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        r"""
+        Randomly split indices in two, keeping the proportion of each class of `stratify` in both splits.
+        The number of test samples is the same as `_train_test_split`, and is allocated to the classes
+        proportionally to their size, with the rounding remainders given to the largest fractional parts.
+        Parameters:
+            indices: The indices to split
+            stratify: The integer class of each index, from 0 to the number of classes
+            test_size: Fraction of the indices to put in the second split
+            seed: Seed for the random splitting
+        Returns:
+            train_indices, test_indices
+        """
+        indices = np.asarray(indices)
+        stratify = np.asarray(stratify)
+        if len(indices) == 0:
+            return indices, indices
+        n_test = int(np.ceil(test_size * len(indices)))
+        random_state = np.random if seed is None else np.random.RandomState(seed)
+
+        # Number of test samples per class
+        class_counts = np.bincount(stratify)
+        exact_test_counts = class_counts * (n_test / len(indices))
+        test_counts = np.floor(exact_test_counts).astype(np.int64)
+        remainders = np.argsort(test_counts - exact_test_counts, kind="stable")
+        test_counts[remainders[: n_test - test_counts.sum()]] += 1
+
+        # A single sort groups the samples by class, in a random order within each class
+        permutation = random_state.permutation(len(indices))
+        permutation = permutation[np.argsort(stratify[permutation], kind="stable")]
+        class_starts = np.concatenate([[0], np.cumsum(class_counts)[:-1]])
+        rank_in_class = np.arange(len(indices)) - np.repeat(class_starts, class_counts)
+        is_test = rank_in_class < np.repeat(test_counts, class_counts)
+
+        test_pos = random_state.permutation(permutation[is_test])
+        train_pos = random_state.permutation(permutation[~is_test])
+        return indices[train_pos], indices[test_pos]
+
     def _sub_sample_df(
         self, df: pd.DataFrame, sample_size: Union[int, float, None], seed: Optional[int] = None
     ) -> pd.DataFrame:
@@ -1945,7 +2572,8 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         subsample from a pandas dataframe
         Parameters:
             df: pandas dataframe to subsample
-            sample_size: number of samples to subsample
+            sample_size: number of samples to subsample if an `int`, or fraction of the samples if a `float`
+            seed: seed for the random sampling
         Returns:
             subsampled pandas dataframe
         """
@@ -1954,7 +2582,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             n = min(sample_size, df.shape[0])
             df = df.sample(n=n, random_state=seed)
         elif isinstance(sample_size, float):
-            df = df.sample(f=sample_size, random_state=seed)
+            df = df.sample(frac=sample_size, random_state=seed)
         elif sample_size is None:
             pass
         else:
@@ -1973,10 +2601,13 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         # pop epoch_sampling_fraction out when creating hash
         # so that the data cache does not need to be regenerated
         # when epoch_sampling_fraction has changed.
-        for task_key, task_args in deepcopy(self.task_specific_args).items():
+        for task_key, task_args in self.task_specific_args.items():
             if isinstance(task_args, DatasetProcessingParams):
                 task_args = task_args.__dict__  # Convert the class to a dictionary
 
+            # Shallow copy, to avoid modifying the arguments without deep-copying the whole dataframes
+            task_args = dict(task_args)
+
             # Keep only first 5 rows of a dataframe
             if "df" in task_args.keys():
                 if task_args["df"] is not None:
@@ -1984,6 +2615,9 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
 
             # Remove the `epoch_sampling_fraction`
             task_args.pop("epoch_sampling_fraction", None)
+            # Unstratified splits keep the hash from before the `stratify` option
+            if not task_args.get("stratify", False):
+                task_args.pop("stratify", None)
             args[task_key] = task_args
 
         hash_dict = {
@@ -2086,13 +2720,19 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
             val_singletask_datasets: Dictionary of val subsets
             test_singletask_datasets: Dictionary of test subsets
         """
-        train_singletask_datasets = {}
-        val_singletask_datasets = {}
-        test_singletask_datasets = {}
-        for task in task_train_indices.keys():
-            train_singletask_datasets[task] = Subset(single_task_datasets[task], task_train_indices[task])
-            val_singletask_datasets[task] = Subset(single_task_datasets[task], task_val_indices[task])
-            test_singletask_datasets[task] = Subset(single_task_datasets[task], task_test_indices[task])
+
+        # Convert the indices to python ints once, so that `Subset.__getitem__` indexes
+        # the single-task datasets without boxing a numpy scalar at every access
+        def get_subsets(task_indices: Dict[str, Iterable]) -> Dict[str, Subset]:
+            subsets = {}
+            for task in task_train_indices.keys():
+                indices = np.asarray(task_indices[task], dtype=np.int64).tolist()
+                subsets[task] = Subset(single_task_datasets[task], indices)
+            return subsets
+
+        train_singletask_datasets = get_subsets(task_train_indices)
+        val_singletask_datasets = get_subsets(task_val_indices)
+        test_singletask_datasets = get_subsets(task_test_indices)
         return train_singletask_datasets, val_singletask_datasets, test_singletask_datasets
 
     def __len__(self) -> int:
@@ -2104,8 +2744,7 @@ class MultitaskFromSmilesDataModule(BaseDataModule, IPUDataModuleModifier):
         num_elements = 0
         for task, args in self.task_dataset_processing_params.items():
             if args.df is None:
-                df = self._read_table(args.df_path, usecols=[args.smiles_col])
-                num_elements += len(df)
+                num_elements += self._get_table_length(args.df_path, usecols=[args.smiles_col])
             else:
                 num_elements += len(args.df)
         return num_elements
@@ -2157,7 +2796,7 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
         batch_size_per_pack: Optional[int] = None,
         num_workers: int = 0,
         pin_memory: bool = True,
-        persistent_workers: bool = False,
+        persistent_workers: Optional[bool] = None,
         multiprocessing_context: Optional[str] = None,
         featurization_n_jobs: int = -1,
         featurization_progress: bool = False,
@@ -2185,7 +2824,7 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
             batch_size_training: batch size for training and val dataset.
             batch_size_inference: batch size for test dataset.
             num_workers: Number of workers for the dataloader. Use -1 to use all available
-                cores.
+                cores, up to `MAX_AUTO_NUM_WORKERS`.
             pin_memory: Whether to pin on paginated CPU memory for the dataloader.
             featurization_n_jobs: Number of cores to use for the featurization.
             featurization_progress: whether to show a progress bar during featurization.
@@ -2204,14 +2843,16 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
         """
 
         new_task_specific_args = {}
+        task_splits = {}
         self.metadata = {}
         for task_name, task_args in task_specific_args.items():
             # Get OGB metadata
             this_metadata = self._get_dataset_metadata(task_args["dataset_name"])
             # Get dataset
-            df, mol_ids_col, smiles_col, label_cols, splits_path = self._load_dataset(
+            df, mol_ids_col, smiles_col, label_cols, splits_path, splits = self._load_dataset(
                 this_metadata, sample_size=task_args.get("sample_size", None)
             )
+            task_splits[task_name] = splits
             new_task_specific_args[task_name] = {
                 "df": df,
                 "mol_ids_col": mol_ids_col,
@@ -2244,6 +2885,12 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
 
         super().__init__(**dm_args, **kwargs)
 
+        # Split with the indices already in memory, rather than reading them back from `splits_path`.
+        # The data hash is computed from `task_specific_args`, so it still depends on the path only.
+        for task_name, splits in task_splits.items():
+            key = self._get_task_key(new_task_specific_args[task_name]["task_level"], task_name)
+            self.task_dataset_processing_params[key].splits_path = splits
+
     def to_dict(self) -> Dict[str, Any]:
         r"""
         geenrate a dictionary representation of the class
@@ -2262,7 +2909,7 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
         self,
         metadata: dict,
         sample_size: Optional[int] = None,
-    ) -> Tuple[pd.DataFrame, str, str, List[str], str]:
+    ) -> Tuple[pd.DataFrame, str, str, List[str], str, Dict[str, np.ndarray]]:
         """
         Download, extract and load an OGB dataset.
         Parameters:
@@ -2275,6 +2922,7 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
             smiles_col: Name of the column containing the SMILES.
             label_cols: List of column names containing the labels.
             splits_path: Path to the file containing the train/val/test splits.
+            splits: The indices of the train/val/test splits, already loaded in memory.
         """
 
         base_dir = fs.get_cache_dir("ogb")
@@ -2299,25 +2947,15 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
         else:
             df_path = dataset_dir / "mapping" / "mol.csv.gz"
         logger.info(f"Loading {df_path} in memory.")
-        df = pd.read_csv(df_path)
+        df = self._read_csv(df_path)
 
         # Subsample the dataset
         df = self._sub_sample_df(df, sample_size)
 
-        # Load split from the OGB dataset and save them in a single CSV file
+        # Load split from the OGB dataset and save them in a single CSV file,
+        # unless they were already saved by a previous call
+        split_name = metadata["split"]
         if metadata["download_name"].startswith("pcqm4m"):
-            split_name = metadata["split"]
-            split_dict = torch.load(dataset_dir / "split_dict.pt")
-            train_split = pd.DataFrame(split_dict["train"])
-            val_split = pd.DataFrame(split_dict["valid"])
-            if "test" in split_dict.keys():
-                test_split = pd.DataFrame(split_dict["test"])
-            else:
-                test_split = pd.DataFrame(split_dict["test-dev"])
-
-            splits = pd.concat([train_split, val_split, test_split], axis=1)  # type: ignore
-            splits.columns = ["train", "val", "test"]
-
             splits_path = dataset_dir / "split"
             if not splits_path.exists():
                 os.makedirs(splits_path)
@@ -2325,18 +2963,33 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
             else:
                 splits_path = splits_path / f"{split_name}.csv.gz"
         else:
-            split_name = metadata["split"]
-            train_split = pd.read_csv(dataset_dir / "split" / split_name / "train.csv.gz", header=None)  # type: ignore
-            val_split = pd.read_csv(dataset_dir / "split" / split_name / "valid.csv.gz", header=None)  # type: ignore
-            test_split = pd.read_csv(dataset_dir / "split" / split_name / "test.csv.gz", header=None)  # type: ignore
+            splits_path = dataset_dir / "split" / f"{split_name}.csv.gz"
 
-            splits = pd.concat([train_split, val_split, test_split], axis=1)  # type: ignore
-            splits.columns = ["train", "val", "test"]
+        # Load the splits of the OGB dataset as arrays of indices
+        if metadata["download_name"].startswith("pcqm4m"):
+            split_dict = torch.load(dataset_dir / "split_dict.pt")
+            test_key = "test" if "test" in split_dict.keys() else "test-dev"
+            splits = {
+                "train": split_dict["train"],
+                "val": split_dict["valid"],
+                "test": split_dict[test_key],
+            }
+        else:
+            split_dir = dataset_dir / "split" / split_name
+            splits = {
+                key: self._read_csv(split_dir / f"{file}.csv.gz", header=None).iloc[:, 0]
+                for key, file in [("train", "train"), ("val", "valid"), ("test", "test")]
+            }
+        splits = {key: np.asarray(split, dtype=np.int64).reshape(-1) for key, split in splits.items()}
 
-            splits_path = dataset_dir / "split" / f"{split_name}.csv.gz"
+        if not splits_path.exists():
+            splits_df = pd.concat([pd.Series(split, name=key) for key, split in splits.items()], axis=1)
 
-        logger.info(f"Saving splits to {splits_path}")
-        splits.to_csv(splits_path, index=None)
+            # Write to a temporary file first, so that an interrupted write is not mistaken for the splits
+            logger.info(f"Saving splits to {splits_path}")
+            tmp_splits_path = splits_path.with_name(f"{splits_path.name}.tmp")
+            splits_df.to_csv(tmp_splits_path, index=None, compression="gzip")
+            os.replace(tmp_splits_path, splits_path)
 
         # Get column names: OGB columns are predictable
         if metadata["download_name"].startswith("pcqm4m"):
@@ -2348,7 +3001,7 @@ class GraphOGBDataModule(MultitaskFromSmilesDataModule):
             smiles_col = df.columns[-2]
             label_cols = df.columns[:-2].to_list()
 
-        return df, mol_ids_col, smiles_col, label_cols, splits_path
+        return df, mol_ids_col, smiles_col, label_cols, splits_path, splits
 
     def _get_dataset_metadata(self, dataset_name: str) -> Dict[str, Any]:
         ogb_metadata = self._get_ogb_metadata()
@@ -2419,7 +3072,7 @@ class ADMETBenchmarkDataModule(MultitaskFromSmilesDataModule):
         batch_size_per_pack: Optional[int] = None,
         num_workers: int = 0,
         pin_memory: bool = True,
-        persistent_workers: bool = False,
+        persistent_workers: Optional[bool] = None,
         multiprocessing_context: Optional[str] = None,
         featurization_n_jobs: int = -1,
         featurization_progress: bool = False,
@@ -2562,7 +3215,7 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
         batch_size_inference: int = 16,
         num_workers: int = 0,
         pin_memory: bool = True,
-        persistent_workers: bool = False,
+        persistent_workers: Optional[bool] = None,
         multiprocessing_context: Optional[str] = None,
         collate_fn: Optional[Callable] = None,
         prepare_dict_or_graph: str = "pyg:graph",
@@ -2594,8 +3247,8 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
         Returns:
             pd.DataFrame
         """
-        num_generated_mols = int(1)
-        # Create a dummy generated dataset - singel smiles string, duplicated N times
+        # Create a dummy generated dataset - a single smiles string. It is not duplicated, since
+        # `FakeDataset` repeats it `num_mols_to_generate` times without materializing the copies.
         example_molecules = dict(
             smiles="C1N2C3C4C5OC13C2C45",
             cxsmiles="[H]C1C2=C(NC(=O)[C@@]1([H])C1=C([H])C([H])=C(C([H])([H])[H])C([H])=C1[H])C([H])=C([H])N=C2[H] |(6.4528,-1.5789,-1.2859;5.789,-0.835,-0.8455;4.8499,-0.2104,-1.5946;3.9134,0.7241,-0.934;3.9796,1.1019,0.3172;5.0405,0.6404,1.1008;5.2985,1.1457,2.1772;5.9121,-0.5519,0.613;6.9467,-0.2303,0.8014;5.677,-1.7955,1.4745;4.7751,-2.7953,1.0929;4.2336,-2.7113,0.154;4.5521,-3.9001,1.914;3.8445,-4.6636,1.5979;5.215,-4.0391,3.1392;4.9919,-5.2514,4.0126;5.1819,-5.0262,5.0671;5.6619,-6.0746,3.7296;3.966,-5.6247,3.925;6.1051,-3.0257,3.52;6.6247,-3.101,4.4725;6.3372,-1.9217,2.7029;7.0168,-1.1395,3.0281;2.8586,1.2252,-1.7853;2.1303,1.9004,-1.3493;2.8118,0.8707,-3.0956;2.0282,1.2549,-3.7434;3.716,0.0207,-3.7371;4.6658,-0.476,-3.0127;5.3755,-1.1468,-3.5021)|",
@@ -2604,8 +3257,7 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
         for label in label_cols:
             example_df_entry[label] = np.random.random()
         df = pd.DataFrame([example_df_entry])
-        logger.info(f"Generating fake dataset on host... \n Generating {num_generated_mols} rows in the df.")
-        df = pd.concat([df] * num_generated_mols, ignore_index=True)
+        logger.info("Generating fake dataset on host... \n Generating a single row in the df.")
         return df
 
     def prepare_data(self):
@@ -2624,9 +3276,6 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
         """
 
         """Load all single-task dataframes."""
-        if self.num_mols_to_generate is None:
-            num_mols = 0
-
         task_df = {}
         for task, args in self.task_dataset_processing_params.items():
             logger.info(f"Reading data for task '{task}'")
@@ -2636,20 +3285,16 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
                     df=None, df_path=args.df_path, label_cols=args.label_cols, smiles_col=args.smiles_col
                 )
                 task_df[task] = self.generate_data(label_cols=args.label_cols, smiles_col=args.smiles_col)
-                if self.num_mols_to_generate is None:
-                    num_mols = max(num_mols, len(task_df[task]))
             task_df[task] = task_df[task].iloc[0:1]
 
             args.label_cols = label_cols
         if self.num_mols_to_generate is None:
-            self.num_mols_to_generate = num_mols
+            # Only the single generated molecule
+            self.num_mols_to_generate = 1
         logger.info("Done reading datasets")
 
         """Subsample the data frames and extract the necessary data to create SingleTaskDatasets for each task (smiles, labels, extras)."""
         task_dataset_args = {}
-        for task in task_df.keys():
-            task_dataset_args[task] = {}
-
         for task, df in task_df.items():
             logger.info(f"Prepare single-task dataset for task '{task}' with {len(df)} data points.")
             # Extract smiles, labels, extras
@@ -2665,10 +3310,12 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
             )
 
             # Store the relevant information for each task's dataset
-            task_dataset_args[task]["smiles"] = smiles
-            task_dataset_args[task]["labels"] = labels
-            task_dataset_args[task]["sample_idx"] = sample_idx
-            task_dataset_args[task]["extras"] = extras
+            task_dataset_args[task] = {
+                "smiles": smiles,
+                "labels": labels,
+                "sample_idx": sample_idx,
+                "extras": extras,
+            }
 
         """Convert SMILES to features (graphs, fingerprints, etc.) for the unique molecules found."""
         all_smiles = []
@@ -2686,9 +3333,11 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
             featurization_batch_size=self.featurization_batch_size,
             backend=self.featurization_backend,
         )
+        all_unique_mol_ids = np.asarray(all_unique_mol_ids, dtype=object)
         # Convert SMILES to features
         features, _ = self._featurize_molecules(all_smiles)
-        task_dataset_args[task]["features"] = features
+        for task, (start, end) in idx_per_task.items():
+            task_dataset_args[task]["features"] = features[start:end]
         """Filter data based on molecules which failed featurization. Create single task datasets as well."""
         self.single_task_datasets = {}
         for task, args in task_dataset_args.items():
@@ -2756,25 +3405,16 @@ class FakeDataModule(MultitaskFromSmilesDataModule):
             df = args.df.iloc[0:20, :]
 
         df = df.iloc[0:20, :]
-        label_cols = self._parse_label_cols(
-            df, df_path=None, label_cols=args.label_cols, smiles_col=args.smiles_col
-        )
 
-        smiles, labels, sample_idx, extras = self._extract_smiles_labels(
-            df,
-            task_level=args.task_level,
-            smiles_col=args.smiles_col,
-            label_cols=label_cols,
-            idx_col=args.idx_col,
-            weights_col=args.weights_col,
-            weights_type=args.weights_type,
-        )
+        # Only the smiles are needed, not the labels or the extras
+        smiles = df[self._get_smiles_col(df, args.smiles_col)].values
 
+        # The molecules are featurized one by one, since the first one is usually valid
         graph = None
         for s in smiles:
             graph = self.smiles_transformer(s, mask_nan=0.0)
-            num_nodes = graph.num_nodes
-            num_edges = graph.num_edges
-            if (graph is not None) and (num_edges > 0) and (num_nodes > 0):
+            if did_featurization_fail(graph):
+                continue
+            if (graph.num_edges > 0) and (graph.num_nodes > 0):
                 break
         return graph
@@ -1,3 +1,5 @@
+import io
+import mmap
 import os
 from copy import deepcopy
 from functools import lru_cache
@@ -5,6 +7,7 @@ from multiprocessing import Manager
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import fsspec
+from fsspec.implementations.local import LocalFileSystem
 import numpy as np
 import torch
 from datamol import parallelized, parallelized_with_batches
@@ -24,7 +27,7 @@ class SingleTaskDataset(Dataset):
         smiles: Optional[List[str]] = None,
         indices: Optional[List[int]] = None,
         weights: Optional[Union[torch.Tensor, np.ndarray]] = None,
-        unique_ids: Optional[List[str]] = None,
+        unique_ids: Optional[Union[List[str], np.ndarray]] = None,
         mol_ids: Optional[List[str]] = None,
     ):
         r"""
@@ -35,7 +38,7 @@ class SingleTaskDataset(Dataset):
             smiles: A list of smiles
             indices: A list of indices
             weights: A list of weights
-            unique_ids: A list of unique ids for each molecule generated from `datamol.unique_id`
+            unique_ids: A list or object array of unique ids for each molecule, from `datamol.unique_id`
             mol_ids: A list of ids coming from the original dataset. Useful to identify the molecule in the original dataset.
         """
 
@@ -456,13 +459,69 @@ class MultitaskDataset(Dataset):
         Returns:
             A dictionary containing the data for the specified index with keys "graph_with_features", "labels" and "smiles" (optional).
         """
-        filename = os.path.join(
-            self.data_path, format(data_idx // 1000, "04d"), format(data_idx, "07d") + ".pkl"
-        )
-        with fsspec.open(filename, "rb") as f:
-            data_dict = torch.load(f)
+        shard_index, shard_pos = divmod(data_idx, 1000)
+        offsets = self._get_shard_offsets(shard_index)
+
+        # Caches prepared by earlier versions of Graphium have one file per molecule
+        if offsets is None:
+            filename = os.path.join(
+                self.data_path, format(shard_index, "04d"), format(data_idx, "07d") + ".pkl"
+            )
+            with fsspec.open(filename, "rb") as f:
+                data_dict = torch.load(f)
+            return data_dict
+
+        start, end = offsets[shard_pos], offsets[shard_pos + 1]
+        shard_buffer = self._get_shard_buffer(shard_index)
+        if shard_buffer is not None:
+            return torch.load(io.BytesIO(shard_buffer[start:end]))
+
+        with fsspec.open(self._get_shard_filename(shard_index), "rb") as f:
+            f.seek(start)
+            data_dict = torch.load(io.BytesIO(f.read(end - start)))
         return data_dict
 
+    def _get_shard_filename(self, shard_index: int) -> str:
+        return os.path.join(self.data_path, format(shard_index, "04d") + ".pt")
+
+    def _get_shard_offsets(self, shard_index: int) -> Optional[List[int]]:
+        r"""
+        Get the byte offsets of the data in a shard file saved by the datamodule, read once per shard.
+        Returns `None` if the shard file does not exist.
+        """
+        shard_offsets = self.__dict__.setdefault("_shard_offsets", {})
+        if shard_index not in shard_offsets:
+            try:
+                with fsspec.open(self._get_shard_filename(shard_index), "rb") as f:
+                    num_data = int(np.frombuffer(f.read(8), dtype="<i8")[0])
+                    offsets = np.frombuffer(f.read(8 * (num_data + 1)), dtype="<i8").tolist()
+            except FileNotFoundError:
+                offsets = None
+            shard_offsets[shard_index] = offsets
+        return shard_offsets[shard_index]
+
+    def _get_shard_buffer(self, shard_index: int) -> Optional[mmap.mmap]:
+        r"""
+        Get a read-only memory map of a local shard file, opened once per shard and process,
+        such that reading a molecule is a copy from the page cache, without opening the file.
+        Returns `None` for remote files, which are read with `fsspec`.
+        """
+        shard_buffers = self.__dict__.setdefault("_shard_buffers", {})
+        if shard_index not in shard_buffers:
+            filename = self._get_shard_filename(shard_index)
+            buffer = None
+            if isinstance(fsspec.core.url_to_fs(filename)[0], LocalFileSystem):
+                with open(filename, "rb") as f:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            shard_buffers[shard_index] = buffer
+        return shard_buffers[shard_index]
+
+    def __getstate__(self):
+        """Serialize the class for pickling, without the memory maps that cannot be pickled."""
+        state = self.__dict__.copy()
+        state.pop("_shard_buffers", None)
+        return state
+
     def merge(
         self, datasets: Dict[str, SingleTaskDataset]
     ) -> Tuple[List[str], List[str], List[Dict[str, Any]], List[Any]]:
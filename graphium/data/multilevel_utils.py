@@ -6,12 +6,32 @@ import itertools
 import math
 
 
+def _is_numeric_df(df: pd.DataFrame) -> bool:
+    """Whether all the columns of a dataframe have a numpy integer or float dtype."""
+    return all(isinstance(dtype, np.dtype) and dtype.kind in "iuf" for dtype in df.dtypes)
+
+
 def extract_labels(df: pd.DataFrame, task_level: str, label_cols: List[str]):
     """Extracts labels in label_cols from dataframe df for a given task_level.
     Returns a list of numpy arrays converted to the correct shape. Multiple
     targets are concatenated for each graph.
     """
 
+    # Fast path for graph labels stored as numeric scalars, copied at once into a single array,
+    # with the same dtype as the rows unpacked below
+    if task_level == "graph":
+        label_df = df[label_cols]
+        if not _is_numeric_df(label_df):
+            # Coerce the scalar objects column by column, rather than cell by cell
+            try:
+                label_df = label_df.apply(pd.to_numeric, errors="coerce")
+            except (TypeError, ValueError):
+                pass  # Some cells are lists or arrays, unpacked below
+        if _is_numeric_df(label_df):
+            dtypes = list(label_df.dtypes)
+            dtype = np.float64 if any(dtype.kind == "f" for dtype in dtypes) else np.int64
+            return label_df.to_numpy(dtype=dtype)
+
     def unpack(graph_data):
         graph_data = pd.to_numeric(graph_data, errors="coerce")
         if isinstance(graph_data, str):
@@ -99,13 +99,18 @@ def smiles_to_unique_mol_ids(
         ids: A list of MD5 hash ids
     """
 
+    # Identical smiles have the same id, so each distinct string is only converted once,
+    # which is common when multiple tasks share the same molecules
+    smiles = list(smiles)
+    distinct_smiles = list(dict.fromkeys(smiles))
+
     batch_size = BatchingSmilesTransform.parse_batch_size(
-        numel=len(smiles), desired_batch_size=featurization_batch_size, n_jobs=n_jobs
+        numel=len(distinct_smiles), desired_batch_size=featurization_batch_size, n_jobs=n_jobs
     )
 
     unique_mol_ids = dm.parallelized_with_batches(
         BatchingSmilesTransform(smiles_to_unique_mol_id),
-        smiles,
+        distinct_smiles,
         batch_size=batch_size,
         progress=progress,
         n_jobs=n_jobs,
@@ -113,4 +118,8 @@ def smiles_to_unique_mol_ids(
         tqdm_kwargs={"desc": f"{progress_desc}, batch={batch_size}"},
     )
 
+    if len(distinct_smiles) < len(smiles):
+        mol_id_per_smiles = dict(zip(distinct_smiles, unique_mol_ids))
+        unique_mol_ids = [mol_id_per_smiles[this_smiles] for this_smiles in smiles]
+
     return unique_mol_ids
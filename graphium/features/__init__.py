@@ -7,3 +7,4 @@ from .featurizer import mol_to_graph_signature
 from .featurizer import GraphDict
 from .featurizer import mol_to_pyggraph
 from .featurizer import to_dense_array
+from .featurizer import get_mol_feature_dims
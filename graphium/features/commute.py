@@ -3,7 +3,8 @@ from typing import Tuple, Union, Dict, Any
 import numpy as np
 
 from scipy.sparse import spmatrix, issparse
-from scipy.linalg import pinv
+
+from graphium.features.electrostatic import compute_laplacian_pinv
 
 
 def compute_commute_distances(
@@ -40,8 +41,7 @@ def compute_commute_distances(
             pinvL = cache["pinvL"]
 
         else:
-            L = np.diagflat(np.sum(adj, axis=1)) - adj
-            pinvL = pinv(L)
+            pinvL = compute_laplacian_pinv(adj)
             cache["pinvL"] = pinvL
 
         dist = volG * np.asarray(
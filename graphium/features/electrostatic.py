@@ -2,8 +2,9 @@ from typing import Tuple, Union, Dict, Any
 
 import numpy as np
 
-from scipy.linalg import pinv
+from scipy.linalg import pinv, cho_factor, cho_solve, LinAlgError
 from scipy.sparse import spmatrix, issparse
+from scipy.sparse.csgraph import connected_components
 
 
 def compute_electrostatic_interactions(
@@ -31,14 +32,66 @@ def compute_electrostatic_interactions(
             pinvL = cache["pinvL"]
 
         else:
-            if issparse(adj):
-                adj = adj.toarray()
-
-            L = np.diagflat(np.sum(adj, axis=1)) - adj
-            pinvL = pinv(L)
+            pinvL = compute_laplacian_pinv(adj)
             cache["pinvL"] = pinvL
 
-        electrostatic = pinvL - np.diag(pinvL)  # This means that the "ground" is set to any given atom
+        # This means that the "ground" is set to any given atom.
+        # The diagonal is a view, broadcast over the rows, so no other array is allocated.
+        electrostatic = pinvL - pinvL.diagonal()[np.newaxis, :]
         cache["electrostatic"] = electrostatic
 
     return electrostatic, base_level, cache
+
+
+def compute_laplacian_pinv(adj: Union[np.ndarray, spmatrix]) -> np.ndarray:
+    """
+    Compute the Moore-Penrose pseudo-inverse of the Laplacian of a graph.
+
+    The Laplacian of a disconnected graph is block-diagonal, with one block per connected component,
+    so its pseudo-inverse is computed block by block.
+
+    Parameters:
+        adj [num_nodes, num_nodes]: Adjacency matrix
+    Returns:
+        pinvL [num_nodes, num_nodes]: Pseudo-inverse of the Laplacian
+    """
+
+    if issparse(adj):
+        adj = adj.toarray()
+
+    L = np.diagflat(np.sum(adj, axis=1)) - adj
+    num_nodes = L.shape[0]
+    if num_nodes == 0:
+        return pinv(L)
+
+    num_components, components = connected_components(adj, directed=False, return_labels=True)
+    if num_components == 1:
+        return _connected_laplacian_pinv(L)
+
+    pinvL = np.zeros(L.shape, dtype=np.result_type(L.dtype, np.float64))
+    for component in range(num_components):
+        idx = np.flatnonzero(components == component)
+        block = np.ix_(idx, idx)
+        pinvL[block] = _connected_laplacian_pinv(L[block])
+
+    return pinvL
+
+
+def _connected_laplacian_pinv(L: np.ndarray) -> np.ndarray:
+    """
+    Compute the pseudo-inverse of the Laplacian `L` of a connected graph.
+
+    The nullspace of `L` is spanned by the constant vector, so its pseudo-inverse is `(L + J)^-1 - J`,
+    with `J` the matrix filled with `1 / num_nodes`. Since `L + J` is symmetric positive definite,
+    it is inverted with a Cholesky factorization, which is much cheaper than the SVD of `pinv`.
+    """
+
+    num_nodes = L.shape[0]
+    J = np.full((num_nodes, num_nodes), 1 / num_nodes)
+    try:
+        pinvL = cho_solve(cho_factor(L + J), np.eye(num_nodes)) - J
+    except LinAlgError:
+        # Not positive definite, for example with negative edge weights
+        pinvL = pinv(L)
+
+    return pinvL
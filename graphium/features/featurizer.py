@@ -1264,3 +1264,113 @@ def mol_to_graph_signature(featurizer_args: Dict[str, Any] = None) -> Dict[str,
         parameters.update(featurizer_args)
 
     return parameters
+
+
+def get_mol_feature_dims(
+    atom_property_list_onehot: List[str] = [],
+    atom_property_list_float: List[Union[str, Callable]] = [],
+    edge_property_list: List[str] = [],
+    **kwargs,
+) -> Dict[str, int]:
+    r"""
+    Get the number of node and edge features computed by `mol_to_graph_dict` for a
+    given featurization, without featurizing any molecule.
+
+    Parameters:
+        atom_property_list_onehot: The one-hot atomic properties, see `get_mol_atomic_features_onehot`
+        atom_property_list_float: The float atomic properties, see `get_mol_atomic_features_float`
+        edge_property_list: The bond properties, see `get_mol_edge_features`
+        kwargs: Other featurization arguments, which do not change the number of features
+    Returns:
+        A dictionary with the number of node features under `"feat"`,
+        and the number of edge features under `"edge_feat"`
+    Raises:
+        ValueError: If a property is not one of the accepted ones
+    """
+
+    onehot_dims = {
+        "atomic-number": len(nmp.ATOM_LIST) + 1,
+        "degree": len(nmp.ATOM_DEGREE_LIST) + 1,
+        "valence": len(nmp.VALENCE) + 1,
+        "implicit-valence": len(nmp.VALENCE) + 1,
+        "hybridization": len(nmp.HYBRIDIZATION_LIST) + 1,
+        "chirality": len(nmp.CHIRALITY_LIST) + 2,
+        "phase": len(nmp.PHASE_SET) + 1,
+        "type": len(nmp.TYPE_SET) + 1,
+        "group": len(nmp.GROUP_SET) + 1,
+        "period": len(nmp.PERIOD_SET) + 1,
+    }
+    float_names = [
+        "atomic-number",
+        "mass",
+        "valence",
+        "implicit-valence",
+        "hybridization",
+        "chirality",
+        "aromatic",
+        "in-ring",
+        "min-ring",
+        "max-ring",
+        "num-ring",
+        "degree",
+        "radical-electron",
+        "formal-charge",
+        "vdw-radius",
+        "covalent-radius",
+        "electronegativity",
+        "ionization",
+        "melting-point",
+        "metal",
+        "group",
+        "period",
+        "single-bond",
+        "aromatic-bond",
+        "double-bond",
+        "triple-bond",
+        "is-carbon",
+    ]
+    aliases = {
+        "total-valence": "valence",
+        "weight": "mass",
+        "ring": "in-ring",
+        "first-ionization": "ionization",
+    }
+    edge_dims = {
+        "bond-type-onehot": len(nmp.BOND_TYPES) + 1,
+        "bond-type-float": 1,
+        "stereo": len(nmp.BOND_STEREO) + 1,
+        "in-ring": 1,
+        "conjugated": 1,
+        "conformer-bond-length": 1,
+        "estimated-bond-length": 1,
+    }
+
+    # The features are stored in dictionaries, so a repeated property is only counted once
+    node_props = {}
+    for prop in atom_property_list_onehot:
+        prop = aliases.get(prop.lower(), prop.lower())
+        if prop not in onehot_dims:
+            raise ValueError(f"Unsupported property `{prop}`")
+        node_props[prop] = onehot_dims[prop]
+
+    float_props = {}
+    for prop in atom_property_list_float:
+        if callable(prop):
+            float_props[str(prop)] = 1
+            continue
+        prop = aliases.get(prop.lower(), prop.lower())
+        if prop not in float_names:
+            raise ValueError(f"Unsupported property `{prop}`")
+        float_props[prop] = 1
+
+    edge_props = {}
+    for prop in edge_property_list:
+        prop = prop.lower()
+        if prop not in edge_dims:
+            raise ValueError(f"Unsupported property `{prop}`")
+        edge_props[prop] = edge_dims[prop]
+
+    return {
+        "feat": sum(node_props.values()) + sum(float_props.values()),
+        "edge_feat": sum(edge_props.values()),
+    }
@@ -1,4 +1,5 @@
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, Optional, Union
+from functools import lru_cache
 
 import torch
 import torch.nn as nn
@@ -20,6 +21,7 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
         num_inference_to_average: int = 1,
         last_layer_is_readout: bool = False,
         name: str = "FullFinetuningGNN",
+        compile_forward: bool = False,
     ):
         r"""
         Flexible class that allows to implement an end-to-end graph finetuning network architecture, supporting flexible pretrained models and finetuning heads.
@@ -59,6 +61,12 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
             name:
                 Name attributed to the current network, for display and printing
                 purposes.
+
+            compile_forward:
+                Whether to run the `forward` compiled with `torch.compile`, which requires torch >= 2.0.
+                It uses dynamic shapes, since the number of nodes and edges changes with every batch.
+                The compilation happens at the first call, and nothing is stored on the module,
+                so it can still be copied and pickled.
         """
 
         super().__init__()
@@ -73,6 +81,7 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
         self.max_num_nodes_per_graph = None
         self.max_num_edges_per_graph = None
         self.finetuning_head = None
+        self.compile_forward = compile_forward
 
         if not isinstance(self.pretrained_model, PretrainedModel):
             self.pretrained_model = PretrainedModel(
@@ -82,6 +91,9 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
         if finetuning_head_kwargs is not None:
             self.finetuning_head = FinetuningHead(finetuning_head_kwargs)
 
+        if self.compile_forward and not hasattr(torch, "compile"):
+            raise RuntimeError(f"`compile_forward` requires torch >= 2.0, got {torch.__version__}")
+
     def forward(self, g: Batch) -> Tensor:
         r"""
         Apply the pre-processing neural network, the graph neural network,
@@ -116,6 +128,15 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
 
         """
 
+        if self.compile_forward:
+            return _get_compiled_forward()(self, g)
+        return self._forward(g)
+
+    def _forward(self, g: Batch) -> Tensor:
+        r"""
+        Apply the pretrained model, then the finetuning head if any. See `forward`.
+        """
+
         g = self.pretrained_model.forward(g)
 
         if self.finetuning_head is not None:
@@ -172,6 +193,15 @@ class FullGraphFinetuningNetwork(nn.Module, MupMixin):
         self.pretrained_model.net.set_max_num_nodes_edges_per_graph(max_nodes, max_edges)
 
 
+@lru_cache(maxsize=1)
+def _get_compiled_forward() -> Callable:
+    r"""
+    Compile `FullGraphFinetuningNetwork._forward` once, as a function taking the network as first argument,
+    so that the compiled function is shared by all the networks and never stored on any of them.
+    """
+    return torch.compile(FullGraphFinetuningNetwork._forward, dynamic=True)
+
+
 class PretrainedModel(nn.Module, MupMixin):
     def __init__(
         self,
@@ -234,12 +264,16 @@ class PretrainedModel(nn.Module, MupMixin):
         module_map = self.net._module_map
         module_map_from_pretrained = pretrained_model._module_map
 
-        module_names_from_pretrained = module_map_from_pretrained.keys()
-        super_module_names_from_pretrained = set(
-            [module_name.split("/")[0] for module_name in module_names_from_pretrained]
-        )
+        super_module_names_from_pretrained = {
+            module_name.split("/")[0] for module_name in module_map_from_pretrained.keys()
+        }
+
+        # The modules are overwritten in the order of the module map, up to the first finetuned one (included)
+        module_names = list(module_map.keys())
+        finetuned_idx = [ii for ii, name in enumerate(module_names) if name.startswith(finetuning_module)]
+        num_overwritten = finetuned_idx[0] + 1 if len(finetuned_idx) > 0 else len(module_names)
 
-        for module_name in module_map.keys():
+        for module_name in module_names[:num_overwritten]:
             # Below exception handles some modules (e.g., pe_encoders in FullGraphMultitaskNetwork) that do not support len());
             # They can always be replaced entirely
             try:
@@ -251,7 +285,7 @@ class PretrainedModel(nn.Module, MupMixin):
             if module_name.startswith(finetuning_module):
                 shared_depth -= added_depth
 
-            if module_name in module_map_from_pretrained.keys():
+            if module_name in module_map_from_pretrained:
                 for idx in range(shared_depth):
                     module_map[module_name][idx] = module_map_from_pretrained[module_name][idx]
             elif module_name.split("/")[0] in super_module_names_from_pretrained:
@@ -262,9 +296,6 @@ class PretrainedModel(nn.Module, MupMixin):
             else:
                 raise RuntimeError("Mismatch between loaded pretrained model and model to be overwritten.")
 
-            if module_name.startswith(finetuning_module):
-                break
-
     def make_mup_base_kwargs(self, divide_factor: float = 2.0) -> Dict[str, Any]:
         """
         Create a 'base' model to be used by the `mup` or `muTransfer` scaling of the model.
@@ -296,6 +327,9 @@ class FinetuningHead(nn.Module, MupMixin):
         """
 
         super().__init__()
+
+        # Pop the options from a copy, so the kwargs of the caller (e.g. the config) are left untouched
+        finetuning_head_kwargs = dict(finetuning_head_kwargs)
         self.task = finetuning_head_kwargs.pop("task", None)
         self.previous_module = finetuning_head_kwargs.pop("previous_module", "task_heads")
         self.incoming_level = finetuning_head_kwargs.pop("incoming_level", "graph")
@@ -308,7 +342,7 @@ class FinetuningHead(nn.Module, MupMixin):
         if isinstance(g, (torch.Tensor, Batch)):
             pass
         elif isinstance(g, Dict) and len(g) == 1:
-            g = list(g.values())[0]
+            g = next(iter(g.values()))
         else:
             raise TypeError("Output type from pretrained model not appropriate for finetuning head")
 
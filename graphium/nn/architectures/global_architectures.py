@@ -1027,7 +1027,8 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
         self.last_layer_is_readout = last_layer_is_readout
         self._concat_last_layers = None
         self.pre_nn, self.pre_nn_edges, self.task_heads = None, None, None
-        self.pe_encoders_kwargs = deepcopy(pe_encoders_kwargs)
+        # Only the top-level dims are read back, and the `EncoderManager` copies the nested kwargs it modifies
+        self.pe_encoders_kwargs = dict(pe_encoders_kwargs) if pe_encoders_kwargs is not None else None
         self.graph_output_nn_kwargs = graph_output_nn_kwargs
         self.encoder_manager = EncoderManager(pe_encoders_kwargs)
         self.max_num_nodes_per_graph = None
@@ -1285,8 +1286,6 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
         # Apply the positional encoders
         g = self.encoder_manager(g)
 
-        e = None
-
         # Run the pre-processing network on node features
         if self.pre_nn is not None:
             g["feat"] = self.pre_nn.forward(g["feat"])
@@ -1295,13 +1294,10 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
         # If there are no edges, skip the forward and change the dimension of e
         if self.pre_nn_edges is not None:
             e = g["edge_feat"]
-            if torch.prod(torch.as_tensor(e.shape[:-1])) == 0:
-                e = torch.zeros(
-                    list(e.shape[:-1]) + [self.pre_nn_edges.out_dim], device=e.device, dtype=e.dtype
-                )
+            if 0 in e.shape[:-1]:
+                g["edge_feat"] = e.new_zeros((*e.shape[:-1], self.pre_nn_edges.out_dim))
             else:
-                e = self.pre_nn_edges.forward(e)
-            g["edge_feat"] = e
+                g["edge_feat"] = self.pre_nn_edges.forward(e)
 
         # Run the graph neural network
         g = self.gnn.forward(g)
@@ -1333,13 +1329,19 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
             name=self.name,
         )
 
+        # Output dims of the pe-encoders, which are concatenated to the inputs of the pre-nns
+        pe_encoders_kwargs = {}
+        if (self.encoder_manager is not None) and (self.pe_encoders_kwargs is not None):
+            pe_encoders_kwargs = self.pe_encoders_kwargs
+        pe_enc_outdim = pe_encoders_kwargs.get("out_dim", 0)
+        pe_enc_edge_outdim = pe_encoders_kwargs.get("edge_out_dim", 0)
+
         # For the pre-nn network, get the smaller dimensions.
         # For the input dim, only divide the features coming from the pe-encoders
         if self.pre_nn is not None:
             kwargs["pre_nn_kwargs"] = self.pre_nn.make_mup_base_kwargs(
                 divide_factor=divide_factor, factor_in_dim=False
             )
-            pe_enc_outdim = 0 if self.encoder_manager is None else self.pe_encoders_kwargs.get("out_dim", 0)
             pre_nn_indim = kwargs["pre_nn_kwargs"]["in_dim"] - pe_enc_outdim
             kwargs["pre_nn_kwargs"]["in_dim"] = round(pre_nn_indim + (pe_enc_outdim / divide_factor))
 
@@ -1348,9 +1350,6 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
             kwargs["pre_nn_edges_kwargs"] = self.pre_nn_edges.make_mup_base_kwargs(
                 divide_factor=divide_factor, factor_in_dim=False
             )
-            pe_enc_edge_outdim = (
-                0 if self.encoder_manager is None else self.pe_encoders_kwargs.get("edge_out_dim", 0)
-            )
             pre_nn_edge_indim = kwargs["pre_nn_edges_kwargs"]["in_dim"] - pe_enc_edge_outdim
             kwargs["pre_nn_edges_kwargs"]["in_dim"] = round(
                 pre_nn_edge_indim + (pe_enc_edge_outdim / divide_factor)
@@ -1402,7 +1401,8 @@ class FullGraphMultiTaskNetwork(nn.Module, MupMixin):
                     layer.max_num_nodes_per_graph = max_nodes
                     layer.max_num_edges_per_graph = max_edges
 
-        self.task_heads.set_max_num_nodes_edges_per_graph(max_nodes, max_edges)
+        if self.task_heads is not None:
+            self.task_heads.set_max_num_nodes_edges_per_graph(max_nodes, max_edges)
 
     def __repr__(self) -> str:
         r"""
@@ -430,15 +430,17 @@ class FCLayer(nn.Module):
 
         """
 
-        if torch.prod(torch.as_tensor(h.shape[:-1])) == 0:
-            h = torch.zeros(
-                list(h.shape[:-1]) + [self.linear.out_features],
-                device=h.device,
-                dtype=h.dtype,
-            )
-            return h
+        if 0 in h.shape[:-1]:
+            return h.new_zeros((*h.shape[:-1], self.linear.out_features))
 
         h = self.linear(h)
+        return self._post_linear(h)
+
+    def _post_linear(self, h: torch.Tensor) -> torch.Tensor:
+        r"""
+        Apply the normalization, dropout, activation and drop path that follow the linear
+        layer, on features that already went through `self.linear`.
+        """
 
         if self.normalization is not None:
             if h.shape[1] != self.out_dim:
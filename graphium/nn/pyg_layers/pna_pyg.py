@@ -3,7 +3,7 @@ from functools import partial
 
 import torch
 from torch import Tensor
-from torch_scatter import scatter
+import torch.nn.functional as F
 
 from torch_geometric.nn.conv import MessagePassing
 from torch_geometric.typing import OptTensor
@@ -15,6 +15,26 @@ from graphium.nn.base_layers import MLP, FCLayer, get_activation
 from graphium.nn.base_graph_layer import BaseGraphStructure, check_intpus_allow_int
 
 
+def _scatter(src: Tensor, index: Tensor, dim_size: Optional[int], reduce: str) -> Tensor:
+    r"""
+    Reduce the rows of `src` that share the same `index`, with the native `Tensor.scatter_reduce_`
+    rather than the `torch_scatter` extension. Rows of the output without any input are set to 0.
+
+    Parameters:
+        src: The values to reduce, with the first dimension being the number of rows
+        index: The output row of each row of `src`
+        dim_size: The number of rows of the output. If `None`, it is `index.max() + 1`
+        reduce: The reduction, e.g. "sum", "amin" or "amax"
+    Returns:
+        out: The reduced values
+    """
+    if dim_size is None:
+        dim_size = int(index.max()) + 1 if index.numel() > 0 else 0
+    index = index.view(-1, *([1] * (src.dim() - 1))).expand_as(src)
+    out = src.new_zeros((dim_size,) + tuple(src.shape[1:]))
+    return out.scatter_reduce_(0, index, src, reduce=reduce, include_self=False)
+
+
 class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
     def __init__(
         self,
@@ -60,7 +80,7 @@ class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
 
             aggregators:
                 Set of aggregation function identifiers,
-                e.g. "mean", "max", "min", "std", "sum", "var", "moment3".
+                e.g. "mean", "max", "min", "std", "sum", "var".
                 The results from all aggregators will be concatenated.
 
             scalers:
@@ -116,6 +136,17 @@ class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
         self.aggregators = aggregators
         self.scalers = scalers
 
+        # Check the aggregators and scalers once, and find which shared quantities they need
+        for aggregator in self.aggregators:
+            if aggregator not in ["sum", "mean", "min", "max", "var", "std"]:
+                raise ValueError(f'Unknown aggregator "{aggregator}".')
+        for scaler in self.scalers:
+            if scaler not in ["identity", "amplification", "attenuation", "linear", "inverse_linear"]:
+                raise ValueError(f'Unknown scaler "{scaler}".')
+        self._use_sum = any(aggregator in ["sum", "mean", "var", "std"] for aggregator in self.aggregators)
+        self._use_squares = any(aggregator in ["var", "std"] for aggregator in self.aggregators)
+        self._use_log_deg = any(scaler in ["amplification", "attenuation"] for scaler in self.scalers)
+
         # Edge dimensions
         self.in_dim_edges = in_dim_edges
         self.edge_encoder = None
@@ -139,6 +170,14 @@ class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
             last_normalization=normalization,
         )
 
+        # Without a normalization before it, the first linear layer of `pretrans` can be applied
+        # to $h_u$, $h_v$ and $e_{uv}$ separately, without concatenating them for every edge
+        self._split_pretrans = (
+            (self.pretrans.first_normalization is None)
+            and (self.pretrans.fully_connected is not None)
+            and (type(self.pretrans.fully_connected[0].linear) is torch.nn.Linear)
+        )
+
         # MLP used on the aggregated messages of the neighbours
         self.posttrans = MLP(
             in_dim=(len(aggregators) * len(scalers)) * self.in_dim,
@@ -179,7 +218,26 @@ class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
             feat: the message
         """
         feat: Tensor = x_i  # Dummy.
-        if (edge_feat is not None) and (self.edge_encoder is not None):
+        if self.edge_encoder is None:
+            edge_feat = None
+
+        if self._split_pretrans and (x_i.shape[0] > 0):
+            # Same as the first linear layer on the concatenation $[h_u, h_v, e_{uv}]$,
+            # with one slice of its weight for each of them
+            first_layer = self.pretrans.fully_connected[0]
+            weight, bias = first_layer.linear.weight, first_layer.linear.bias
+            feat = F.linear(x_i, weight[:, : self.in_dim], bias)
+            feat = feat + F.linear(x_j, weight[:, self.in_dim : 2 * self.in_dim])
+            if edge_feat is not None:
+                # The edge encoder is linear, without activation, so it is folded into the edge slice
+                # of the weight, and a single product is computed on the edges
+                encoder = self.edge_encoder.linear
+                edge_weight = weight[:, 2 * self.in_dim :]
+                feat = feat + F.linear(edge_feat, edge_weight @ encoder.weight, edge_weight @ encoder.bias)
+            feat = first_layer._post_linear(feat)
+            return self.pretrans.fully_connected[1:](feat)  # No more towers
+
+        if edge_feat is not None:
             edge_feat = self.edge_encoder(edge_feat)
             feat = torch.cat([x_i, x_j, edge_feat], dim=-1)
         else:
@@ -205,47 +263,59 @@ class PNAMessagePassingPyg(MessagePassing, BaseGraphStructure):
         Returns:
             out: aggregated features
         """
-        outs = []
+        deg = degree(index, dim_size, dtype=inputs.dtype)
+        deg = deg.clamp_(1).view(-1, 1)
 
-        for aggregator in self.aggregators:
+        # The sums are scattered once, and shared by the mean, var and std aggregators
+        if self._use_sum:
+            out_sum = _scatter(inputs, index, dim_size, reduce="sum")
+            mean = out_sum / deg
+        if self._use_squares:
+            mean_squares = _scatter(inputs * inputs, index, dim_size, reduce="sum") / deg
+            var = mean_squares - mean * mean
+
+        # The aggregations are written in place in a single buffer, rather than concatenated
+        num_nodes, num_feats = deg.shape[0], inputs.shape[-1]
+        out = inputs.new_empty((num_nodes, len(self.aggregators), num_feats))
+        for ii, aggregator in enumerate(self.aggregators):
             if aggregator == "sum":
-                out = scatter(inputs, index, 0, None, dim_size, reduce="sum")
+                out[:, ii] = out_sum
             elif aggregator == "mean":
-                out = scatter(inputs, index, 0, None, dim_size, reduce="mean")
+                out[:, ii] = mean
             elif aggregator == "min":
-                out = scatter(inputs, index, 0, None, dim_size, reduce="min")
+                out[:, ii] = _scatter(inputs, index, dim_size, reduce="amin")
             elif aggregator == "max":
-                out = scatter(inputs, index, 0, None, dim_size, reduce="max")
-            elif aggregator in ["var", "std"]:
-                mean = scatter(inputs, index, 0, None, dim_size, reduce="mean")
-                mean_squares = scatter(inputs * inputs, index, 0, None, dim_size, reduce="mean")
-                out = mean_squares - mean * mean
-                if aggregator == "std":
-                    out = torch.sqrt(torch.relu(out) + 1e-5)
+                out[:, ii] = _scatter(inputs, index, dim_size, reduce="amax")
+            elif aggregator == "var":
+                out[:, ii] = var
+            elif aggregator == "std":
+                out[:, ii] = torch.sqrt(torch.relu(var) + 1e-5)
             else:
                 raise ValueError(f'Unknown aggregator "{aggregator}".')
-            outs.append(out)
-        out = torch.cat(outs, dim=-1)
+        out = out.view(num_nodes, -1)
 
-        deg = degree(index, dim_size, dtype=inputs.dtype)
-        deg = deg.clamp_(1).view(-1, 1)
+        # The log-degree is computed once, for both the amplification and attenuation scalers
+        if self._use_log_deg:
+            log_deg = torch.log(deg + 1)
 
-        outs = []
+        # Each scaler is a factor per node, so all of them are applied with a single broadcast product
+        factors = []
         for scaler in self.scalers:
             if scaler == "identity":
-                out_scaler = out
+                factor = torch.ones_like(deg)
             elif scaler == "amplification":
-                out_scaler = out * (torch.log(deg + 1) / self.avg_d["log"])
+                factor = log_deg / self.avg_d["log"]
             elif scaler == "attenuation":
-                out_scaler = out * (self.avg_d["log"] / torch.log(deg + 1))
+                factor = self.avg_d["log"] / log_deg
             elif scaler == "linear":
-                out_scaler = out * (deg / self.avg_d["lin"])
+                factor = deg / self.avg_d["lin"]
             elif scaler == "inverse_linear":
-                out_scaler = out * (self.avg_d["lin"] / deg)
+                factor = self.avg_d["lin"] / deg
             else:
                 raise ValueError(f'Unknown scaler "{scaler}".')
-            outs.append(out_scaler)
-        return torch.cat(outs, dim=-1)
+            factors.append(factor)
+        factors = torch.stack(factors, dim=1)
+        return (out.unsqueeze(1) * factors).view(num_nodes, -1)
 
     @property
     def layer_outputs_edges(self) -> bool:
@@ -1,5 +1,9 @@
 ##### Code adapted from the `mup` package from Microsoft https://github.com/microsoft/mup
 
+from contextlib import nullcontext
+from typing import ContextManager
+
+import torch
 from torch.nn import Linear
 from torch.nn.modules.conv import _ConvNd
 from mup import get_shapes, assert_hidden_size_inf, MuReadout, rescale_linear_bias, save_base_shapes
@@ -8,6 +12,21 @@ from mup.shape import _zip_infshape_dict, _extract_shapes
 from graphium.nn.base_layers import MuReadoutGraphium
 
 
+def meta_device_context() -> ContextManager:
+    """
+    Context in which the modules are instantiated on the `meta` device, meaning that
+    the parameters have a shape but are neither allocated nor initialized.
+    Useful for models that are only needed for their kwargs or their base shapes.
+
+    On pytorch versions where `torch.device` is not a context manager (<2.0),
+    a no-op context is returned and the modules are instantiated normally.
+    """
+    meta = torch.device("meta")
+    if hasattr(meta, "__enter__"):
+        return meta
+    return nullcontext()
+
+
 def apply_infshapes(model, infshapes):
     """
     Modified from the regular `mup.apply_infshapes` by explicitly adding `base_dim` to the `MuReadoutGraphium`.
@@ -1,4 +1,6 @@
 import unittest as ut
+import os
+import tempfile
 import numpy as np
 import torch
 import pandas as pd
@@ -7,6 +9,8 @@ import datamol as dm
 import graphium
 from graphium.utils.fs import rm, exists, get_size
 from graphium.data import GraphOGBDataModule, MultitaskFromSmilesDataModule
+from graphium.data.datamodule import BaseDataModule
+from graphium.data.normalization import LabelNormalization
 
 TEMP_CACHE_DATA_PATH = "tests/temp_cache_0000"
 
@@ -483,6 +487,155 @@ class Test_DataModule(ut.TestCase):
 
         self.assertEqual(len(ds.train_ds), 20)
 
+    def test_read_table_sample(self):
+        parquet_file = "tests/data/micro_ZINC_shard_*.parquet"
+        task_specific_args = {
+            "task": {
+                "task_level": "graph",
+                "label_cols": ["score"],
+                "smiles_col": "SMILES",
+                "df_path": parquet_file,
+            }
+        }
+        ds = MultitaskFromSmilesDataModule(task_specific_args, featurization_n_jobs=0)
+
+        # Sampling while reading the parquet files gives the same rows as sampling the full table
+        df_full = ds._read_table(parquet_file, usecols=["SMILES", "score"])
+        df_expected = df_full.sample(n=7, random_state=42)
+        df_sampled = ds._read_table(parquet_file, sample_size=7, seed=42, usecols=["SMILES", "score"])
+        pd.testing.assert_frame_equal(df_sampled, df_expected)
+
+        # An empty sample has the same columns and dtypes as the full table
+        df_sampled = ds._read_table(parquet_file, sample_size=0, seed=42, usecols=["SMILES", "score"])
+        pd.testing.assert_frame_equal(df_sampled, df_full.sample(n=0, random_state=42))
+
+        # Same with csv files, which are sampled after reading
+        csv_file = "tests/data/micro_ZINC_shard_*.csv"
+        df_full = ds._read_table(csv_file, usecols=["SMILES", "score"])
+        df_sampled = ds._read_table(csv_file, sample_size=7, seed=42, usecols=["SMILES", "score"])
+        pd.testing.assert_frame_equal(df_sampled, df_full.sample(n=7, random_state=42))
+
+    def test_train_test_split(self):
+        from sklearn.model_selection import train_test_split
+
+        indices = np.arange(100, 237)
+        for test_size in [0.1, 0.25, 0.5]:
+            expected = train_test_split(indices, test_size=test_size, random_state=42)
+            splits = MultitaskFromSmilesDataModule._train_test_split(indices, test_size=test_size, seed=42)
+            for split, expected_split in zip(splits, expected):
+                np.testing.assert_array_equal(split, expected_split)
+
+    def test_get_positions(self):
+        rng = np.random.default_rng(42)
+        for sample_idx, sample_pos in [
+            (rng.permutation(200)[:150], None),
+            (np.arange(150), pd.RangeIndex(150)),
+            (rng.integers(0, 100, size=150), None),  # Duplicated indices
+        ]:
+            if sample_pos is None:
+                sample_pos = pd.Index(sample_idx)
+            for indices in [rng.integers(-10, 250, size=80), np.array([])]:
+                _, expected, _ = np.intersect1d(sample_idx, indices, return_indices=True)
+                positions = MultitaskFromSmilesDataModule._get_positions(sample_pos, indices)
+                self.assertListEqual(positions.tolist(), expected.tolist())
+
+    def test_stratified_train_test_split(self):
+        rng = np.random.default_rng(42)
+        stratify = np.repeat([0, 1, 2], [70, 20, 10])
+        indices = rng.permutation(1000)[:100]
+        train, test = MultitaskFromSmilesDataModule._stratified_train_test_split(
+            indices, stratify, test_size=0.3, seed=42
+        )
+
+        # Same split sizes as the non-stratified split, with the proportion of each class kept
+        self.assertEqual(len(train), 70)
+        self.assertEqual(len(test), 30)
+        self.assertListEqual(sorted(np.concatenate([train, test]).tolist()), sorted(indices.tolist()))
+        class_of_index = dict(zip(indices.tolist(), stratify.tolist()))
+        test_classes = np.array([class_of_index[idx] for idx in test.tolist()])
+        self.assertListEqual(np.bincount(test_classes).tolist(), [21, 6, 3])
+
+    def test_get_stratify_labels(self):
+        labels = np.array([[0, 1], [1, np.nan], [np.nan, np.nan], [1, 0]], dtype=np.float16)
+        get_stratify_labels = MultitaskFromSmilesDataModule._get_stratify_labels
+
+        # Stratification is opt-in, and missing labels are a class of their own
+        self.assertIsNone(get_stratify_labels(labels, stratify=False))
+        classes = get_stratify_labels(labels, stratify=True)
+        np.testing.assert_array_equal(classes, [[0, 1], [1, 2], [2, 2], [1, 0]])
+
+        # Regression labels cannot be stratified
+        with self.assertRaises(ValueError):
+            get_stratify_labels(np.array([[0.5], [1.0]]), stratify=True)
+
+    def test_get_unique_indices(self):
+        ids = ["b", "a", "c", "a", "b", "d", "c"]
+        unique_idx, inverse = MultitaskFromSmilesDataModule._get_unique_indices(ids)
+        np.testing.assert_array_equal(unique_idx, [0, 1, 2, 5])
+        np.testing.assert_array_equal(inverse, [0, 1, 2, 1, 0, 3, 2])
+
+    def test_normalize_task_labels(self):
+        rng = np.random.default_rng(42)
+        task_norm = LabelNormalization(method="normal", verbose=False)
+        task_norm.calculate_statistics(rng.normal(size=(20, 3)))
+
+        # Graph labels, node labels, and labels that are normalized one by one
+        all_values = [
+            [rng.normal(size=3) for _ in range(10)],
+            [rng.normal(size=(n, 3)) for n in [1, 4, 2, 5]],
+            [rng.normal(size=3), rng.normal(size=(2, 3))],
+        ]
+        for values in all_values:
+            normalized = MultitaskFromSmilesDataModule._normalize_task_labels(values, task_norm)
+            self.assertEqual(len(normalized), len(values))
+            for value, norm_value in zip(values, normalized):
+                np.testing.assert_allclose(norm_value, task_norm.normalize(value))
+
+    def test_arrays_to_float16(self):
+        # Fixed-length arrays
+        values = [np.array([1.0, 2.0, 3.0]), np.array([4.0, 5.0, 6.0])]
+        converted = BaseDataModule._arrays_to_float16(values)
+        self.assertEqual(len(converted), 2)
+        for original, new in zip(values, converted):
+            self.assertEqual(new.dtype, np.float16)
+            np.testing.assert_array_equal(new, original.astype(np.float16))
+
+        # Ragged lists
+        values = [[1.0, 2.0], [3.0], [4.0, 5.0, 6.0]]
+        converted = BaseDataModule._arrays_to_float16(values)
+        self.assertEqual([len(elem) for elem in converted], [2, 1, 3])
+        for original, new in zip(values, converted):
+            self.assertEqual(new.dtype, np.float16)
+            np.testing.assert_array_equal(new, np.asarray(original, dtype=np.float16))
+
+    def test_get_sdf_columns(self):
+        record = "\n".join(
+            [
+                "mol_1",
+                "  RDKit          3D",
+                "",
+                "  1  0  0  0  0  0  0  0  0  0999 V2000",
+                "    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0",
+                "M  END",
+                ">  <score>  (1) ",
+                "1.5",
+                "",
+                "> <label_2>",
+                "0",
+                "",
+                "$$$$",
+                "",
+            ]
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "mols.sdf")
+            with open(path, "w") as f:
+                f.write(record + record.replace("label_2", "other"))
+
+            columns = BaseDataModule._get_table_columns(path)
+
+        self.assertListEqual(columns, ["smiles", "score", "label_2", "_rdkit_molecule_obj"])
+
 
 if __name__ == "__main__":
     ut.main()
@@ -14,6 +14,7 @@ from graphium.features.featurizer import (
     get_mol_edge_features,
     mol_to_adj_and_features,
     mol_to_pyggraph,
+    get_mol_feature_dims,
 )
 
 
@@ -220,6 +221,24 @@ class test_featurizer(ut.TestCase):
                             self.assertGreaterEqual(edata.shape[1], num_props, msg=err_msg2)
                         self.assertGreaterEqual(ndata.shape[1], num_props, msg=err_msg2)
 
+    def test_get_mol_feature_dims(self):
+        featurization = dict(
+            atom_property_list_onehot=self.atomic_onehot_props,
+            atom_property_list_float=self.atomic_float_props,
+            edge_property_list=self.edge_props,
+        )
+        graph = mol_to_pyggraph(mol=self.smiles[3], **featurization, on_error="raise")
+        feat_dims = get_mol_feature_dims(**featurization)
+        self.assertEqual(feat_dims["feat"], graph["feat"].shape[-1])
+        self.assertEqual(feat_dims["edge_feat"], graph["edge_feat"].shape[-1])
+
+        # Without edge properties, and with aliases of the same properties
+        feat_dims = get_mol_feature_dims(atom_property_list_float=["mass", "weight", "ring"])
+        self.assertDictEqual(feat_dims, {"feat": 2, "edge_feat": 0})
+
+        with self.assertRaises(ValueError):
+            get_mol_feature_dims(edge_property_list=["not-a-property"])
+
     def test_mol_to_pyggraph(self):
         np.random.seed(42)
 
@@ -6,7 +6,9 @@ import numpy as np
 import networkx as nx
 import unittest as ut
 
-from graphium.features.electrostatic import compute_electrostatic_interactions
+from scipy.linalg import pinv
+
+from graphium.features.electrostatic import compute_electrostatic_interactions, compute_laplacian_pinv
 from graphium.features.commute import compute_commute_distances
 from graphium.features.graphormer import compute_graphormer_distances
 
@@ -66,6 +68,18 @@ class test_positional_encodings(ut.TestCase):
             pe, _, _ = compute_commute_distances(adj, adj.shape[0], cache={})
             np.testing.assert_array_almost_equal(pe, pe.T)
 
+    def test_laplacian_pinv(self):
+        for _, adj in self.adj_dict.items():
+            L = np.diagflat(np.sum(adj, axis=1)) - adj
+            np.testing.assert_array_almost_equal(compute_laplacian_pinv(adj), pinv(L))
+
+        # Disconnected graph, with an isolated node
+        adj = np.zeros((10, 10))
+        adj[:6, :6] = self.adj_dict["6-ring"]
+        adj[6:9, 6:9] = 1 - np.eye(3)
+        L = np.diagflat(np.sum(adj, axis=1)) - adj
+        np.testing.assert_array_almost_equal(compute_laplacian_pinv(adj), pinv(L))
+
     def test_max_dist(self):
         for key, adj in self.adj_dict.items():
             pe, _, _ = compute_graphormer_distances(adj, adj.shape[0], cache={})